@@ -0,0 +1,162 @@
+"""
+ ╔╗ ┬┌┬┐┌─┐┬ ┬┌─┐┬─┐┌─┐┌─┐  ╔╦╗┌─┐─┐ ┬  ╦ ╦─┐ ┬
+ ╠╩╗│ │ └─┐├─┤├─┤├┬┘├┤ └─┐   ║║├┤ ┌┴┬┘  ║ ║┌┴┬┘
+ ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
+Bitshares Decentralized Exchange User Experience
+
+In memory search index for the market picker
+"""
+# STANDARD MOUDLES
+from collections import OrderedDict
+from heapq import nsmallest
+from threading import Lock
+
+# BITSHARES DEX UX MODULES
+from config import PICKER_LIMIT
+from utilities import is_whitelisted
+
+# longest n-gram in the index; longer queries intersect their trigrams
+GRAM = 3
+# distinct (query, asset types) results to remember
+CACHE_SIZE = 1024
+# (entry kind, use_types key)
+KINDS = [("mpa", "mpa"), ("uia", "uia"), ("lp", "k_token"), ("pool", "pool")]
+
+
+def ngrams(text):
+    """
+    every substring of text up to GRAM characters long
+    """
+    return {
+        text[idx : idx + size]
+        for size in range(1, GRAM + 1)
+        for idx in range(len(text) - size + 1)
+    }
+
+
+def pool_symbol(pool):
+    """
+    the padded id and asset names shown for a pool in the picker
+    """
+    return (
+        pool["id"].ljust(17, "*")
+        + "".join([j.ljust(17, "*") for j in pool["xyk"].split(":")[:-1:]])
+    ).replace("*", "&nbsp;")
+
+
+class AssetSearch:
+    """
+    n-gram index over asset symbols, descriptions and pool xyk strings
+    built from the metadata cache and rebuilt whenever the cache changes
+    search() results are ranked, deduplicated, sorted and cached per query
+    """
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+        self.lock = Lock()
+        self.version = None
+        # ([(kind, text, description, result), ...], {ngram: {entry index, ...}})
+        self.index = ([], {})
+        self.cache = OrderedDict()
+
+    def build(self):
+        """
+        index every asset and pool in the metadata cache
+        """
+        version = self.metadata.version
+        entries = []
+        for asset in list(self.metadata.assets.values()):
+            kind = asset.get("asset_type") or (
+                "mpa"
+                if asset["bitasset_id"]
+                else "lp"
+                if asset["pool_id"]
+                else "uia"
+            )
+            result = {
+                "symbol": asset["symbol"],
+                "id": asset["id"],
+                "greyscale": is_whitelisted(asset["symbol"]),
+            }
+            description = str(asset.get("description") or "").upper()
+            entries.append((kind, asset["symbol"], description, result))
+        for pool in list(self.metadata.pools.values()):
+            symbol = pool_symbol(pool)
+            result = {
+                "symbol": symbol,
+                "xyk": pool["xyk"],
+                "share_asset_name": pool["share_asset_name"],
+                "id": pool["id"],
+                "greyscale": is_whitelisted(symbol),
+            }
+            entries.append(("pool", pool["xyk"], "", result))
+        # index order is symbol order, so ranking only has to compare integers
+        entries.sort(key=lambda x: x[3]["symbol"])
+        grams = {}
+        for idx, (_, text, description, _) in enumerate(entries):
+            for gram in ngrams(text) | ngrams(description):
+                grams.setdefault(gram, set()).add(idx)
+        with self.lock:
+            self.index = (entries, grams)
+            self.cache.clear()
+            self.version = version
+
+    def search(self, sql, query, use_types, limit=PICKER_LIMIT):
+        """
+        assets and pools of the selected types which contain query
+        exact matches first, then prefix, then substring, then description matches
+        """
+        self.metadata.refresh(sql)
+        if self.version != self.metadata.version:
+            self.build()
+        kinds = frozenset(kind for kind, use_type in KINDS if use_types[use_type])
+        key = (query, kinds, bool(use_types["bts"]), limit)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return list(self.cache[key])
+        results = self.rank(query, kinds, limit)
+        if use_types["bts"] and not any(i["symbol"] == "BTS" for i in results):
+            results.append({"symbol": "BTS", "greyscale": is_whitelisted("BTS")})
+        with self.lock:
+            self.cache[key] = results
+            while len(self.cache) > CACHE_SIZE:
+                self.cache.popitem(last=False)
+        return list(results)
+
+    def rank(self, query, kinds, limit=None):
+        """
+        the best ranked entries of the given kinds which match query, in order
+        """
+        entries, grams = self.index
+        if not query:
+            candidates = range(len(entries))
+        elif len(query) <= GRAM:
+            candidates = grams.get(query, ())
+        else:
+            postings = sorted(
+                (
+                    grams.get(query[idx : idx + GRAM], set())
+                    for idx in range(len(query) - GRAM + 1)
+                ),
+                key=len,
+            )
+            candidates = set.intersection(*postings)
+        ranked = []
+        for idx in candidates:
+            kind, text, description, _ = entries[idx]
+            if kind not in kinds:
+                continue
+            if text == query:
+                rank = 0
+            elif text.startswith(query):
+                rank = 1
+            elif query in text:
+                rank = 2
+            elif query in description:
+                rank = 3
+            else:
+                continue
+            ranked.append((rank, idx))
+        ranked = nsmallest(limit, ranked) if limit else sorted(ranked)
+        return [entries[idx][3] for _, idx in ranked]
@@ -6,12 +6,74 @@ Bitshares Decentralized Exchange User Experience
 """
 
 KIBANA_BATCH = 50000
-KIBANA_SLEEP = 0.01
+# hits per elastic search query, the most kibana returns at once
+KIBANA_PAGE = 10000
+# time windows a history fetch is split into, and searches in flight at once
+KIBANA_WINDOWS = 16
+KIBANA_WORKERS = 8
+# seconds, windows are never split shorter than this up front
+KIBANA_MIN_WINDOW = 3600
+# search one point in time snapshot of the index, held open this long between pages
+KIBANA_PIT = False
+KIBANA_PIT_KEEP_ALIVE = "1m"
 KIBANA_HISTORY = 86400 * 365
-KIBANA_OVERLAP = 86400 * 2
+# backfill a new market's order book candles with elastic search aggregations,
+# downloading individual trades only for the last KIBANA_RECENT seconds
+# UNTESTED against a live cluster, the painless scripted metric has only run in a
+# python stand-in; when the aggregation fails the backfill falls back to trades
+KIBANA_AGGREGATE = False
+KIBANA_RECENT = 86400
+# seconds re-fetched before the sync cursor, for operations indexed late
+KIBANA_OVERLAP = 60 * 2
+# syncs of a market started over because another process synced it first
+KIBANA_SYNC_ATTEMPTS = 3
 KIBANA_CLIP = 2000
 KIBANA_CANDLE_LIFE = 60 * 5
 
 DEFAULT_PAIR = "BTS_HONEST.MONEY"
 
+PICKER_LIMIT = 500
+# tickers fetched at once for the market picker
+TICKER_CONCURRENCY = 256
+# seconds between checks for assets or pools written by another process
+METADATA_CHECK = 10
+
+# seconds between head block polls, and blocks between pool balance refreshes
+BLOCK_SECONDS = 3
+POOL_REFRESH_BLOCKS = 2
+# blocks between recomputing every watched market, changed or not
+FEED_REFRESH_BLOCKS = 20
+# seconds without a block notice before the market feed resubscribes on another node
+FEED_STALL = BLOCK_SECONDS * 3
+
 RPC_USE_INTERNAL_HANDLER = False
+# seconds to wait on the response to one request before giving up on it
+RPC_TIMEOUT = 10
+# ticker, book and object reads remembered, each for at most one block
+RPC_CACHE_SIZE = 4096
+RPC_CACHE_TTL = BLOCK_SECONDS
+# account names remembered in memory, and fetched from the node per request
+ACCOUNT_CACHE_SIZE = 65536
+ACCOUNT_BATCH = 100
+
+# upstream node connections shared by every websocket client
+HUB_CONNECTIONS = 2
+# requests one client may have in flight on the shared connections
+HUB_CLIENT_INFLIGHT = 4
+# seconds between websocket pings, a missed pong closes the connection
+HUB_HEARTBEAT = 10
+# also send slow book, ticker and blocknum reads to a second node
+HUB_HEDGE = False
+# hedge once a read takes longer than this percentile of its node's latency
+HEDGE_PERCENTILE = 95
+# seconds to wait before hedging while a node has fewer than HEDGE_MIN_SAMPLES
+HEDGE_DELAY = 0.5
+HEDGE_MIN_SAMPLES = 20
+# response times kept per node for the percentiles
+LATENCY_SAMPLES = 1000
+
+# seconds between node health checks, and allowed to connect or answer one
+NODE_PROBE_SECONDS = 60
+NODE_TIMEOUT = 5
+# seconds a node's head block may trail the freshest node's and still be in sync
+NODE_MAX_LAG = 10
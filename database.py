@@ -8,14 +8,38 @@ Bitshares Decentralized Exchange User Experience
 Initalize database and provide simple interface for accessing database
 """
 # STANDARD MOUDLES
+import asyncio
 import json
 import os
 import time
-from sqlite3 import Row, connect
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from sqlite3 import OperationalError, connect
+from threading import Lock, local
 
 # GLOBAL CONSTANTS
 DEV = False
 PATH = os.path.dirname(os.path.abspath(__file__)) + "/database"
+# milliseconds sqlite will wait on a locked database before raising
+BUSY_TIMEOUT = 5000
+# attempts at a query which still fails with "database is locked" after BUSY_TIMEOUT
+ATTEMPTS = 3
+# threads reading for AsyncSql, each keeps its own reader connection
+READ_THREADS = 4
+# queries allowed to wait on the AsyncSql executors before callers are held back
+READ_QUEUE = 256
+WRITE_QUEUE = 64
+PRAGMAS = [
+    # readers see the last commit while the writer appends to the log
+    "PRAGMA journal_mode=WAL",
+    # WAL is durable across application crashes with NORMAL
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT}",
+    # negative cache_size is in KiB, so this is 64MB of page cache per connection
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA temp_store=MEMORY",
+]
 CREATES = [
     """
     CREATE TABLE nodes (
@@ -38,7 +62,10 @@ CREATES = [
     c3600 TEXT,
     c1800 TEXT,
     c900 TEXT,
-    discrete TEXT
+    discrete TEXT,
+    last_unix INT,
+    last_block INT,
+    revision INT DEFAULT 0
     )
     """,
     """
@@ -51,7 +78,8 @@ CREATES = [
     precision INT,
     maker_fee DECIMAL,
     taker_fee DECIMAL,
-    description TEXT
+    description TEXT,
+    asset_type TEXT
     )
     """,
     """
@@ -69,7 +97,9 @@ CREATES = [
     withdrawal_fee_percent DECIMAL,
     virtual_value DECIMAL,
     pair TEXT,
-    xyk TEXT
+    xyk TEXT,
+    volume_a DECIMAL,
+    volume_b DECIMAL
     )
     """,
     """
@@ -80,6 +110,135 @@ CREATES = [
     )
     """,
 ]
+# columns added after the first release, added to existing databases by upgrade()
+# (table, column, declaration, query which fills the column in for existing rows)
+COLUMNS = [
+    (
+        "assets",
+        "asset_type",
+        "TEXT",
+        """
+        UPDATE assets SET asset_type = CASE
+        WHEN bitasset_id <> '' THEN 'mpa' WHEN pool_id <> '' THEN 'lp' ELSE 'uia' END
+        WHERE asset_type IS NULL
+        """,
+    ),
+    # 24h exchange volume of each side of a pool, kept current by pool_refresher
+    (
+        "pools",
+        "volume_a",
+        "DECIMAL",
+        "UPDATE pools SET volume_a = 0 WHERE volume_a IS NULL",
+    ),
+    (
+        "pools",
+        "volume_b",
+        "DECIMAL",
+        "UPDATE pools SET volume_b = 0 WHERE volume_b IS NULL",
+    ),
+    # kibana sync cursor, the time and block of the newest trade in the candles
+    (
+        "klines",
+        "last_unix",
+        "INT",
+        "UPDATE klines SET last_unix = 0 WHERE last_unix IS NULL",
+    ),
+    (
+        "klines",
+        "last_block",
+        "INT",
+        "UPDATE klines SET last_block = 0 WHERE last_block IS NULL",
+    ),
+    # bumped by every candle sync, which writes only if it is still what it read
+    (
+        "klines",
+        "revision",
+        "INT DEFAULT 0",
+        "UPDATE klines SET revision = 0 WHERE revision IS NULL",
+    ),
+]
+# tables, indexes and triggers added after the first release
+# created with the others by restart() and on existing databases by upgrade()
+UPGRADES = [
+    """
+    CREATE TABLE IF NOT EXISTS candles (
+    pair TEXT,
+    interval INT,
+    time INT,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL,
+    PRIMARY KEY (pair, interval, time)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS trades (
+    pair TEXT,
+    time INT,
+    price REAL,
+    volume REAL,
+    account TEXT,
+    blocknum INT,
+    op_id TEXT,
+    hover TEXT,
+    PRIMARY KEY (pair, op_id)
+    )
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS trades_pair_time ON trades (pair, time)
+    """,
+    # bumped by every process which adds assets or pools, so that the others
+    # know to reload their metadata cache; balance updates leave it alone
+    """
+    CREATE TABLE IF NOT EXISTS versions (name TEXT PRIMARY KEY, version INT)
+    """,
+    """
+    INSERT OR IGNORE INTO versions (name, version) VALUES ('metadata', 0)
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS assets_version AFTER INSERT ON assets BEGIN
+    UPDATE versions SET version = version + 1 WHERE name = 'metadata';
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS pools_version AFTER INSERT ON pools BEGIN
+    UPDATE versions SET version = version + 1 WHERE name = 'metadata';
+    END
+    """,
+]
+# hot queries which must be answered by index searches alone
+# no table or index scans, nor sorts outside the index
+PLANS = [
+    # sql_utils.read_candles()
+    (
+        "SELECT time, open, high, low, close, volume FROM candles"
+        " WHERE pair=? AND interval=? AND time>=? AND time<=? ORDER BY time",
+        ("1.3.0:1.3.1", 900, 0, 1),
+    ),
+    # sql_utils.read_trades()
+    (
+        "SELECT time, price, volume, account, blocknum, op_id, hover FROM trades"
+        " WHERE pair=? ORDER BY time",
+        ("1.3.0:1.3.1",),
+    ),
+    # sql_utils.read_account_names()
+    (
+        "SELECT account_id, account_name FROM accounts WHERE account_id IN (?,?)",
+        ("1.2.0", "1.2.1"),
+    ),
+    # sql_utils.pool_lookup() and the other metadata cache misses
+    ("SELECT * FROM pools WHERE id=?", ("1.19.0",)),
+    ("SELECT * FROM assets WHERE id=?", ("1.3.0",)),
+    ("SELECT * FROM assets WHERE symbol=?", ("BTS",)),
+    ("SELECT version FROM versions WHERE name='metadata'", ()),
+    # kibana sync cursor
+    (
+        "SELECT end_unix, last_unix, last_block, revision FROM klines WHERE pair=?",
+        ("1.3.0:1.3.1",),
+    ),
+]
 SELECTS = [
     """
     SELECT * FROM nodes
@@ -105,12 +264,87 @@ UPDATES = [
         ("999.9", "1000", "INITIALIZING"),
     ),
 ]
+# columns which hold JSON text, every other column is returned exactly as stored
+JSON_COLUMNS = {
+    "klines": [
+        "c86400",
+        "c43200",
+        "c14400",
+        "c7200",
+        "c3600",
+        "c1800",
+        "c900",
+        "discrete",
+    ],
+}
+JSON_KEYS = {column for columns in JSON_COLUMNS.values() for column in columns}
 DATABASE = PATH + "/test"
 ASSETS = ["HONEST.USD", "BTS"]
 NODES = ["wss://api.bts.mobi/wss"]
 PAIRS = ["HONEST.USD:BTS"]
 
 
+class ConnectionPool:
+    """
+    persistent sqlite3 connections shared by every Sql() in this process
+    one reader connection per thread and a single serialized writer connection
+    in WAL mode readers never block on the writer, nor the writer on readers
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.readers = local()
+        self.writer = None
+        self.write_lock = Lock()
+        # bumped by close() so that per thread readers reconnect lazily
+        self.generation = 0
+
+    def connect(self, query_only=False):
+        """
+        open a new connection to the database with tuned pragmas
+        """
+        con = connect(
+            self.database, timeout=BUSY_TIMEOUT / 1000, check_same_thread=False
+        )
+        for pragma in PRAGMAS:
+            con.execute(pragma)
+        if query_only:
+            con.execute("PRAGMA query_only=1")
+        return con
+
+    def reader(self):
+        """
+        the reader connection belonging to the calling thread
+        """
+        if getattr(self.readers, "generation", None) != self.generation:
+            self.readers.con = self.connect(query_only=True)
+            self.readers.generation = self.generation
+        return self.readers.con
+
+    @contextmanager
+    def write(self):
+        """
+        exclusive use of the single writer connection
+        """
+        with self.write_lock:
+            if self.writer is None:
+                self.writer = self.connect()
+            yield self.writer
+
+    def close(self):
+        """
+        close the writer and invalidate every reader, ie. before erasing the database
+        """
+        with self.write_lock:
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+            self.generation += 1
+
+
+POOL = ConnectionPool(DATABASE)
+
+
 class Sql:
     """
     creation of graphene database and execution of queries
@@ -126,7 +360,8 @@ class Sql:
         print("\033c")
         print("WARNING THIS SCRIPT WILL RESTART DATABASE AND ERASE ALL DATA\n")
         # erase the database
-        command = f"rm {DATABASE}"
+        POOL.close()
+        command = f"rm -f {DATABASE} {DATABASE}-wal {DATABASE}-shm"
         print("\033c", command, "\n")
         os.system(command)
         print("creating sqlite3:", DATABASE, "\n")
@@ -143,7 +378,7 @@ class Sql:
             )
         # new table creation
         queries = []
-        for query in CREATES:
+        for query in CREATES + UPGRADES:
             dml = {"query": query, "values": tuple()}
             queries.append(dml)
         self.execute(queries)
@@ -163,22 +398,40 @@ class Sql:
         for query in SELECTS:
             print(query, self.execute(query))
 
-    def execute(self, query, values=()):
+    def upgrade(self):
+        """
+        bring an existing database up to date with tables added since it was created
+        """
+        queries = []
+        for table, column, declaration, backfill in COLUMNS:
+            existing = self.execute(f"PRAGMA table_info({table})", raw=True)
+            if column not in [i[1] for i in existing]:
+                query = f"ALTER TABLE {table} ADD COLUMN {column} {declaration}"
+                queries.append({"query": query, "values": tuple()})
+            queries.append({"query": backfill, "values": tuple()})
+        queries.extend({"query": query, "values": tuple()} for query in UPGRADES)
+        self.execute(queries)
+
+    def check_query_plans(self):
+        """
+        raise AssertionError if any step of the PLANS is not an index search
         """
-        execute discrete sql queries, handle race condition gracefully
-        if query is a string, assume values is a
+        scans = []
+        for query, values in PLANS:
+            for row in self.execute(f"EXPLAIN QUERY PLAN {query}", values, raw=True):
+                if not row[-1].startswith("SEARCH"):
+                    scans.append(f"{row[-1]}: {query}")
+        if scans:
+            raise AssertionError("scans or sorts in:\n" + "\n".join(scans))
+
+    def execute(self, query, values=(), raw=False):
+        """
+        execute discrete sql queries on the pooled connections
+        if query is a string, assume values is a tuple of its parameters
         else, query can be a list of dicts with keys ["query","values"]
-        While True:
-            Try:
-                con = connect(DB)
-                cur = con.cursor()
-                cur.execute(query, values)
-                ret = cur.fetchall()
-                con.commit()
-                con.close()
-                break
-            Except:
-                continue
+        a single SELECT is read on this thread's reader connection
+        anything else is written in one transaction on the serialized writer
+        rows are dicts with JSON_COLUMNS decoded, or plain tuples when raw
         :return ret:
         """
         queries = []
@@ -195,57 +448,170 @@ class Sql:
             if DEV:
                 print(f"'query': {dml['query']}")
                 print(f"'values': {dml['values']}\n")
-        # attempt to update database until satisfied
-        pause = -1
-        curfetchall = None
-        data = None
-        while True:
+        # only allow batched write queries
+        if len(queries) > 1:
+            for dml in queries:
+                if "SELECT" in dml["query"]:
+                    raise ValueError("batch queries must be write only")
+        readonly = len(queries) == 1 and queries[0]["query"].upper().startswith(
+            "SELECT"
+        )
+        # busy_timeout already waits out the writer, so only retry a few times
+        for attempt in range(ATTEMPTS):
+            try:
+                if readonly:
+                    columns, curfetchall = self.read(queries[0])
+                else:
+                    columns, curfetchall = self.write(queries)
+                break
+            except OperationalError as error:
+                if "locked" not in str(error) or attempt == ATTEMPTS - 1:
+                    print(error, queries)
+                    raise
+                print("Race condition at", int(time.time()), error)
+                time.sleep(0.01 * 2**attempt)
+        if raw:
+            return curfetchall
+        data = [dict(zip(columns, row)) for row in curfetchall]
+        # only columns declared in JSON_COLUMNS are ever parsed
+        for key in JSON_KEYS.intersection(columns):
+            for row in data:
+                if isinstance(row[key], str):
+                    row[key] = json.loads(row[key])
+        return data
+
+    def executemany(self, query, rows):
+        """
+        run one write query over every row of parameters in a single transaction
+        :return int(rows written):
+        """
+        query = " ".join(query.replace("\n", " ").split())
+        if DEV:
+            print(f"'query': {query}")
+            print(f"'rows': {len(rows)}\n")
+        if not rows:
+            return 0
+        for attempt in range(ATTEMPTS):
+            try:
+                with POOL.write() as con:
+                    try:
+                        cur = con.executemany(query, rows)
+                        con.commit()
+                    except Exception:
+                        con.rollback()
+                        raise
+                return cur.rowcount
+            except OperationalError as error:
+                if "locked" not in str(error) or attempt == ATTEMPTS - 1:
+                    print(error, query)
+                    raise
+                print("Race condition at", int(time.time()), error)
+                time.sleep(0.01 * 2**attempt)
+        return 0
+
+    @contextmanager
+    def snapshot(self):
+        """
+        every SELECT within reads the same commit, on this thread's reader connection
+        """
+        con = POOL.reader()
+        con.execute("BEGIN")
+        try:
+            yield
+        finally:
+            con.execute("COMMIT")
+
+    def write_if(self, guard, queries):
+        """
+        run the guard write and then queries as one transaction on the writer
+        nothing is written when the guard changes no row, ie. a compare and swap
+        :return bool(written):
+        """
+        queries = [guard] + queries
+        for dml in queries:
+            dml["query"] = " ".join(dml["query"].replace("\n", " ").split())
+        with POOL.write() as con:
+            try:
+                if not con.execute(guard["query"], guard["values"]).rowcount:
+                    con.rollback()
+                    return False
+                for dml in queries[1:]:
+                    con.execute(dml["query"], dml["values"])
+                con.commit()
+            except Exception:
+                con.rollback()
+                raise
+        return True
+
+    @staticmethod
+    def read(dml):
+        """
+        run a single SELECT on the calling thread's reader connection
+        :return (column names, rows):
+        """
+        cur = POOL.reader().execute(dml["query"], dml["values"])
+        return [i[0] for i in cur.description or ()], cur.fetchall()
+
+    @staticmethod
+    def write(queries):
+        """
+        run write queries as one transaction on the writer connection
+        :return (column names, rows) of the last query:
+        """
+        cur = None
+        with POOL.write() as con:
             try:
-                pause += 1
-                # only allow batched write queries
-                if len(queries) > 1:
-                    for dml in queries:
-                        if "SELECT" in dml["query"]:
-                            raise ValueError("batch queries must be write only")
-                # ======================================================================
-                # SQL CONNECT
-                # ======================================================================
-                con = connect(DATABASE)
                 for dml in queries:
-                    con.row_factory = Row
-                    cur = con.cursor()
-                    cur.execute(dml["query"], dml["values"])
-                    curfetchall = cur.fetchall()
-                # print(curfetchall)
+                    cur = con.execute(dml["query"], dml["values"])
+                curfetchall = cur.fetchall() if cur else []
                 con.commit()
-                con.close()
-                # ======================================================================
-                # SQL CLOSE
-                # ======================================================================
-                # print(curfetchall)
-                data = [dict(i) for i in curfetchall]
-                for idx, row in enumerate(data):
-                    for key, val in row.items():
-                        # attempt to load as JSON
-                        try:
-                            data[idx][key] = json.loads(val)
-                        # otherwise give raw
-                        except Exception:
-                            data[idx][key] = val
-                return data
-            except Exception as error:
-                print(error)
-                print("Race condition at", int(time.time()))
-                try:
-                    print(dml)
-                except Exception:
-                    pass
-                # raise
-                # ascending pause here prevents excess cpu on corruption of database
-                # and allows for decreased load during race condition
-                time.sleep(min(5, 0.01))
-                continue
-        return data
+            except Exception:
+                con.rollback()
+                raise
+        return [i[0] for i in (cur and cur.description) or ()], curfetchall
+
+
+class AsyncSql:
+    """
+    awaitable interface to Sql() so that coroutines never block the event loop
+    reads run on a small thread pool, writes are serialized on one writer thread
+    each executor has a bounded queue, when it is full callers wait their turn
+    """
+
+    readers = ThreadPoolExecutor(READ_THREADS, thread_name_prefix="sql-read")
+    writer = ThreadPoolExecutor(1, thread_name_prefix="sql-write")
+    read_queue = None
+    write_queue = None
+
+    def __init__(self):
+        self.sql = Sql()
+        # semaphores are created lazily so they bind to the running event loop
+        if AsyncSql.read_queue is None:
+            AsyncSql.read_queue = asyncio.Semaphore(READ_QUEUE)
+            AsyncSql.write_queue = asyncio.Semaphore(WRITE_QUEUE)
+
+    async def execute(self, query, values=(), raw=False):
+        """
+        awaitable Sql.execute(); same arguments and return value
+        """
+        queries = [{"query": query}] if isinstance(query, str) else query
+        write = len(queries) > 1 or not queries[0]["query"].lstrip().upper().startswith(
+            "SELECT"
+        )
+        return await self.run(Sql.execute, query, values, raw, write=write)
+
+    async def run(self, func, *args, write=False):
+        """
+        run a blocking database helper as func(Sql(), *args) on an executor
+        ie. await sql.run(precision, asset_id)
+        """
+        queue, executor = (
+            (self.write_queue, self.writer) if write else (self.read_queue, self.readers)
+        )
+        async with queue:
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, lambda: func(self.sql, *args)
+            )
 
 
 def unit_test():
@@ -255,6 +621,7 @@ def unit_test():
     print("\033c")
     sql = Sql()
     sql.restart()
+    sql.check_query_plans()
 
 
 if __name__ == "__main__":
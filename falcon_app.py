@@ -9,7 +9,7 @@ Bitshares Decentralized Exchange User Experience
 # STANDARD MODULES
 import asyncio
 import contextlib
-import json
+import functools
 import time
 import traceback
 
@@ -18,11 +18,23 @@ import falcon
 import falcon.asgi
 
 # BITSHARES DEX UX MODULES
-from database import Sql
+from database import AsyncSql, Sql
 from json_to_html import json_to_html
 from kibana import fetch_candles, format_chart_type
-from rpc import rpc_book, rpc_get_objects, rpc_ticker, wss_handshake
-from sql_utils import id_name_lookup, list_assets_sql
+from market_feed import MARKET_FEED
+from node_monitor import node_monitor
+from pool_refresher import pool_refresher
+from rpc import RPC_HUB, rpc_book, rpc_get_objects, rpc_ticker
+from sql_utils import (
+    METADATA,
+    canonical_market,
+    id_name_lookup,
+    list_assets_sql,
+    migrate_klines,
+    pool_lookup,
+    read_candles,
+    read_trades,
+)
 from utilities import it
 
 
@@ -41,14 +53,13 @@ async def serve_blocknum(ws, rpc):
         rpc = error_handler("", rpc)
 
 
+async def ticker_payload(rpc, contract, pair):
+    return "" if contract.startswith("1.19.") else await rpc_ticker(rpc, pair)
+
+
 async def serve_ticker(ws, rpc, contract, pair):
     await ws.send_media(
-        {
-            "resource": "ticker",
-            "payload": (
-                "" if contract.startswith("1.19.") else await rpc_ticker(rpc, pair)
-            ),
-        }
+        {"resource": "ticker", "payload": await ticker_payload(rpc, contract, pair)}
     )
 
 
@@ -65,9 +76,7 @@ async def serve_picker(args):
             use_types,
             base_asset,
         ) = args
-        data = list_assets_sql(sql, currency, use_types)
-        # stringify all items in data, list(set(data)), and load it again
-        data = [json.loads(i) for i in {json.dumps(j) for j in data}]
+        data = await sql.run(list_assets_sql, currency, use_types)
         data = await json_to_html(
             ws,
             rpc,
@@ -89,7 +98,7 @@ class SocketResource:
     Serve a websocket
     """
 
-    def parse_req_params(self, req, userid, sql):
+    async def parse_req_params(self, req, userid, sql):
         """
         receive request params and parse them for either socketify or uvicorn backends
         """
@@ -116,16 +125,9 @@ class SocketResource:
         if "contract" not in req_params:
             req_params["contract"] = "1.0.0"
         if req_params["contract"].startswith("1.19."):
-            query = [
-                {
-                    "query": (
-                        "SELECT * FROM pools WHERE asset_a_name=? AND asset_b_name=?"
-                        " AND id=?"
-                    ),
-                    "values": (asset, currency, req_params["contract"]),
-                }
-            ]
-            pool_data = sql.execute(query)[0]
+            pool_data = await sql.run(
+                pool_lookup, req_params["contract"], asset, currency
+            )
 
         # FIXME does this matter? where does it carry? is None ok? IS THIS EVEN NEEDED?
         base_asset = asset if first_choice else "BTS"
@@ -149,6 +151,53 @@ class SocketResource:
         )
 
     async def gather_orderbook(self, pool_data, rpc, pair, req_params, ws):
+        """
+        Gather the orderbook and send it to the client
+        """
+        data = await self.book_payload(pool_data, rpc, pair, req_params)
+        await ws.send_media({"resource": "book", "payload": data})
+
+    async def market_update(self, pool_data, rpc, pair, req_params, contract):
+        """
+        The book and ticker messages pushed by the MARKET_FEED to every client
+        watching this market
+        """
+        return [
+            {
+                "resource": "book",
+                "payload": await self.book_payload(pool_data, rpc, pair, req_params),
+            },
+            {
+                "resource": "ticker",
+                "payload": await ticker_payload(rpc, contract, pair),
+            },
+        ]
+
+    async def watch_market(self, ws, pool_data, pair, req_params, contract):
+        """
+        Have the MARKET_FEED push this market's book and ticker to the client
+        pools change with the pool refresher, other markets with node notices
+        """
+        # the market is shared by its watchers, so key it, and the refresh,
+        # on the market alone and never on one client's connection or params
+        depth = int(req_params.get("depth", 50))
+        key = (contract if pool_data else pair, depth)
+        await MARKET_FEED.watch(
+            ws,
+            key,
+            pair,
+            functools.partial(
+                self.market_update,
+                pool_data,
+                RPC_HUB.client(),
+                pair,
+                {"depth": depth},
+                contract,
+            ),
+            (lambda: METADATA.pools.get(contract)) if pool_data else None,
+        )
+
+    async def book_payload(self, pool_data, rpc, pair, req_params):
         """
         Gather orderbook information either from the pool data or via RPC request
         Parameters:
@@ -160,9 +209,12 @@ class SocketResource:
         Returns:
             data (dict): A dictionary containing the bid and ask orderbook information
         """
+        data = {}
         try:
             asset, currency = pair.split(":")
             if pool_data:
+                # the pool refresher keeps the cached balances a few blocks fresh
+                pool_data = METADATA.pools.get(pool_data["id"], pool_data)
 
                 def pool(x_start, y_start, delta_x):
                     """
@@ -214,8 +266,9 @@ class SocketResource:
                 }
             else:
                 data = await rpc_book(rpc, pair, int(req_params.get("depth", 50)))
+            # the book branch of json_to_html never uses the websocket
             data = await json_to_html(
-                ws,
+                None,
                 rpc,
                 "book",
                 data,
@@ -227,86 +280,76 @@ class SocketResource:
             )
         except Exception as error:
             await error_handler("", rpc)
-        await ws.send_media({"resource": "book", "payload": data})
+        return data
 
     async def fast_candles(self, ws, sql, pair, userid, req_params, params, contract):
         """
         make call to database and immediately do a ws.send_media()
         stale is ok, bad ux is not
         """
-        query = [
-            {
-                "query": "SELECT * FROM klines WHERE pair=?",
-                "values": (":".join([id_name_lookup(sql, i) for i in pair.split(":")]),)
-                if contract == "1.0.0"
-                else (contract,),
-            }
-        ]
         # the market is asset_id:currency_id for this kline trading pair
-        market = ":".join([id_name_lookup(sql, i) for i in pair.split(":")])
+        market = ":".join([await sql.run(id_name_lookup, i) for i in pair.split(":")])
+        pair_key = market if contract == "1.0.0" else contract
         # in the database the klines are stored the oldest token first, regardless of the user request
-        sql_market = ":".join(
-            [
-                f"1.3.{x}"
-                for x in sorted(
-                    [int(i[4:]) for i in market.split(":")]
-                )
+        sql_market = canonical_market(market)
+        if params["candle_size"] == "discrete":
+            result = await sql.run(read_trades, pair_key)
+        else:
+            result = await sql.run(
+                read_candles, pair_key, int(params["candle_size"][1:])
+            )
+        if result:
+            print(
+                userid,
+                it(
+                    "green",
+                    "Sending candle data directly from database for"
+                    f" {params['chart_type']} {params['candle_size']} chart...",
+                ),
+            )
+            # print(result)
+            if params["candle_size"] != "discrete":
+                result = format_chart_type(params["chart_type"], result)
+            # print(result)
+            result = [
+                params["chart_type"],
+                result,
+                params["candle_size"],
             ]
-        )
-        if result := sql.execute(query):
-            if result[0]["c86400"]:
-                print(
-                    userid,
-                    it(
-                        "green",
-                        "Sending candle data directly from database for"
-                        f" {params['chart_type']} {params['candle_size']} chart...",
-                    ),
-                )
-                result = result[0][params["candle_size"]]
-                # print(result)
-                if params["candle_size"] != "discrete":
-                    result = format_chart_type(params["chart_type"], result)
-                # print(result)
-                result = [
-                    params["chart_type"],
-                    result,
-                    params["candle_size"],
-                ]
-                if market != sql_market:
-                    # for idx, item in enumerate(ret[1][0]):
-                    #     ret_new[0].append(item)
-                    #     ret_new[1].append(1/ret[1][1][idx])
-                    #     ret_new[2].append(ret[1][2][idx])
-                    #     ret_new[3].append(ret[1][3][idx])
-                    #     ret_new[4].append(ret[1][4][idx])
-                    #     ret_new[5].append(ret[1][5][idx])
-                    #     ret_new[6].append(ret[1][6][idx])
-                    # for discrete we just invert the price; idx=1
-                    result[1]=(
-                        [
-                        list(i)
-                        for i in list(
-                            zip(
-                                [
-                                    [j if idx != 1 else 1 / j for idx, j in enumerate(i)]
-                                    for i in list(zip(result[1]))
-                                ]
-                            )
+            if market != sql_market:
+                # for idx, item in enumerate(ret[1][0]):
+                #     ret_new[0].append(item)
+                #     ret_new[1].append(1/ret[1][1][idx])
+                #     ret_new[2].append(ret[1][2][idx])
+                #     ret_new[3].append(ret[1][3][idx])
+                #     ret_new[4].append(ret[1][4][idx])
+                #     ret_new[5].append(ret[1][5][idx])
+                #     ret_new[6].append(ret[1][6][idx])
+                # for discrete we just invert the price; idx=1
+                result[1]=(
+                    [
+                    list(i)
+                    for i in list(
+                        zip(
+                            [
+                                [j if idx != 1 else 1 / j for idx, j in enumerate(i)]
+                                for i in list(zip(result[1]))
+                            ]
                         )
-                    ]
-                    if params["candle_size"] == "discrete"
-                    # for non-discrete we invert everything except time and volume
-                    else [
-                            {
-                                k: (1 / v if (("time" not in k) and ("volume" not in k)) else v)
-                                for k, v in i.items()
-                            }
-                            for i in result[1]
-                        ]
                     )
+                ]
+                if params["candle_size"] == "discrete"
+                # for non-discrete we invert everything except time and volume
+                else [
+                        {
+                            k: (1 / v if (("time" not in k) and ("volume" not in k)) else v)
+                            for k, v in i.items()
+                        }
+                        for i in result[1]
+                    ]
+                )
 
-                await ws.send_media({"resource": "candles", "payload": result})
+            await ws.send_media({"resource": "candles", "payload": result})
 
     async def on_websocket(self, req, ws):
         """
@@ -351,18 +394,9 @@ class SocketResource:
         await ws.accept()
 
         userid = int(time.time() * 1000000000)
-        print(userid, "[NODE] Initalizing WSS connection...")
-        # Connection to a list of BitShares public API nodes and keep it alive
-        # rpc = await wss_handshake()
-        while True:
-            try:
-                rpc = await wss_handshake()
-                break
-            except Exception as e:
-                print(e.args, traceback.format_exc())
-        ping_task = asyncio.create_task(ping_node(rpc))
-        print(userid, "[NODE] WSS connection initialized.")
-        sql = Sql()
+        # every client shares the hub's connections to the BitShares public API nodes
+        rpc = RPC_HUB.client()
+        sql = AsyncSql()
         try:
             (
                 asset,
@@ -373,7 +407,7 @@ class SocketResource:
                 req_params,
                 pool_data,
                 pair,
-            ) = self.parse_req_params(req, userid, sql)
+            ) = await self.parse_req_params(req, userid, sql)
             resource = req_params["resource"]
             params = {
                 "chart_type": req_params.get("chart_type", "line"),
@@ -398,14 +432,15 @@ class SocketResource:
             try:
                 # query the appropriate resource
                 if resource == "blocknum":
-                    # FIXME: does blocknum _need_ to be in the running_tasks dict?
-                    #        Nothing ever changes for it.
+                    # serve the current block once, the MARKET_FEED pushes the rest
                     asyncio.create_task(serve_blocknum(ws, rpc))
+                    MARKET_FEED.watch_blocks(ws)
                 elif resource == "book":
                     args = [pool_data, rpc, pair, req_params, ws]
                     running_tasks[resource].append(
                         [args, asyncio.create_task(self.gather_orderbook(*args))]
                     )
+                    await self.watch_market(ws, pool_data, pair, req_params, contract)
                 elif resource == "candles":
                     args = [
                         ws,
@@ -438,6 +473,13 @@ class SocketResource:
                     running_tasks[resource].append(
                         [args, asyncio.create_task(serve_ticker(*args))]
                     )
+                    await self.watch_market(
+                        ws,
+                        pool_data if contract.startswith("1.19.") else {},
+                        pair,
+                        req_params,
+                        contract,
+                    )
                 # print(
                 #     "\n".join(
                 #         [
@@ -489,16 +531,9 @@ class SocketResource:
                 if resource == "book":
                     pool_data = {}
                     if recv["contract"].startswith("1.19."):
-                        query = [
-                            {
-                                "query": (
-                                    "SELECT * FROM pools WHERE asset_a_name=? AND"
-                                    " asset_b_name=? AND id=?"
-                                ),
-                                "values": (asset, currency, recv["contract"]),
-                            }
-                        ]
-                        pool_data = sql.execute(query)[0]
+                        pool_data = await sql.run(
+                            pool_lookup, recv["contract"], asset, currency
+                        )
                 elif resource == "candles":
                     # recv contains the candle req data plus some other things
                     # but for these purposes, those other things are ok
@@ -521,17 +556,10 @@ class SocketResource:
                     print(it("red", "unknown resource"), resource)
 
                 # don't need to do anything special for ticker or blocknum
-
-                # if the ping_task found a bad node, use the new node it returned
-                if ping_task.done():
-                    rpc = await ping_task
-                    ping_task = asyncio.create_task(ping_node(rpc))
             except falcon.WebSocketDisconnected:
-                print(userid, "[NODE] Closing WSS connection...")
-                ping_task.cancel()
+                await MARKET_FEED.forget(ws)
                 with contextlib.suppress(Exception):
                     await rpc.close()
-                print(userid, "[NODE] WSS connection closed.")
                 print(userid, "Ending all asyncio.Tasks()...")
                 for tasks in running_tasks.values():
                     for task in tasks:
@@ -544,44 +572,85 @@ class SocketResource:
                 break
             except Exception:
                 num_errors += 1
-                # show the error and switch nodes
+                # show the error, the hub switches nodes by itself
                 try:
                     rpc = await error_handler(userid, rpc, num_errors)
-                    ping_task.cancel()
-                    ping_task = asyncio.create_task(ping_node(rpc))
                 except Exception as error:
                     print(error)
 
 
-async def error_handler(userid, rpc, num_errors):
+async def error_handler(userid, rpc, num_errors=0):
     """
-    Print the error and reconnect to bitshares node
+    Print the error and back off briefly after repeated failures
+    the RPC_HUB replaces failed node connections by itself
     """
     print(userid, "Websocket loop failed with error:")
     print(it("red", traceback.format_exc()))
     if num_errors % 3 == 0:
-        with contextlib.suppress(Exception):
-            await rpc.close()
-        print(userid, "Handling and trying again in one second...")
+        print(userid, "Handling and trying again shortly...")
         await asyncio.sleep(0.1)
-        print(userid, "[NODE] Initalizing WSS connection...")
-        rpc = await wss_handshake()
-        print(userid, "[NODE] WSS connection initialized.")
     return rpc
 
 
-async def ping_node(rpc):
+class Daemons:
     """
-    Ping the `handshake` with a keepalive signal (get chain id) every ten seconds
+    Run the node health monitor, pool balance refresher and market feed
+    for the lifetime of the app
     """
-    while True:
-        print("[NODE] ping")
-        if not (await rpc_get_objects(rpc, ["2.8.0"])):
-            print(it("orange", "X" * 10 + "[NODE] no response from node! " + "X" * 10))
-            rpc = await wss_handshake()
-            break
-        await asyncio.sleep(10)
-    return rpc
+
+    def __init__(self):
+        self.tasks = []
+
+    async def process_startup(self, scope, event):
+        self.tasks = [
+            asyncio.create_task(node_monitor()),
+            asyncio.create_task(pool_refresher()),
+            asyncio.create_task(MARKET_FEED.run()),
+        ]
+
+    async def process_shutdown(self, scope, event):
+        for task in self.tasks:
+            task.cancel()
+        await RPC_HUB.close()
+
+
+class StubRpc:
+    """
+    answers the book and ticker queries of one market without a node
+    """
+
+    async def query(self, params):
+        return {
+            "get_order_book": {
+                "asks": [{"price": "2.0", "quote": "3.0"}],
+                "bids": [{"price": "1.5", "quote": "4.0"}],
+            },
+            "get_ticker": {"latest": "1.75", "base_volume": "10", "percent_change": "-1"},
+        }[params[1]]
+
+
+def unit_test():
+    """
+    render the order book of a market and of a pool from a stub rpc
+    """
+
+    async def books():
+        resource = SocketResource()
+        pool = {
+            "id": "1.19.0",
+            "asset_a_name": "BTS",
+            "asset_b_name": "HONEST.MONEY",
+            "balance_a": 100.0,
+            "balance_b": 200.0,
+        }
+        for pool_data in [{}, pool]:
+            data = await resource.book_payload(
+                pool_data, StubRpc(), "BTS:HONEST.MONEY", {"depth": 1}
+            )
+            assert "Last Price" in data["book"], data
+            print("book_payload", "pool" if pool_data else "market", "ok")
+
+    asyncio.run(books())
 
 
 # Add resource endpoints to falcon App
@@ -589,5 +658,12 @@ async def ping_node(rpc):
 # `pypy3.9 -m socketify falcon_website:app`
 # or with similar ASGI hosting engine
 print("\033c")
-app = falcon.asgi.App()
+Sql().upgrade()
+migrate_klines(Sql())
+METADATA.load()
+app = falcon.asgi.App(middleware=[Daemons()])
 app.add_route("/", SocketResource())
+
+
+if __name__ == "__main__":
+    unit_test()
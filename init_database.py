@@ -8,150 +8,157 @@ Bitshares Decentralized Exchange User Experience
 Initalize database with rpc queried data
 """
 # STANDARD MOUDLES
+import asyncio
 import contextlib
 import json
+import sys
 import time
-import asyncio
 
 # BITSHARES DEX UX MODULES
 from database import Sql
 from rpc import get_max_object, rpc_get_objects, wss_handshake
-from sql_utils import name_id_lookup
+from sql_utils import METADATA, name_id_lookup
 
 BATCH = 100
+# get_objects batches kept in flight at once on the shared connection
+CONCURRENCY = 8
+
 
+def checkpoint(sql, table, space):
+    """
+    the highest object instance already stored, -1 if none
+    every window is committed in id order, so the sync resumes from here
+    SQL SECURITY: table is hard coded by the callers below
+    """
+    query = f"SELECT max(CAST(substr(id, ?) AS INTEGER)) FROM {table}"
+    ret = sql.execute(query, (len(space) + 1,), raw=True)[0][0]
+    return -1 if ret is None else ret
 
-def assets():
+
+async def fetch_objects(rpc, space, start, stop, concurrency):
+    """
+    yield every object from start to stop in windows of id ordered objects
+    each window keeps `concurrency` get_objects batches in flight at once
+    """
+    for window in range(start, stop + 1, BATCH * concurrency):
+        batches = await asyncio.gather(
+            *[
+                rpc_get_objects(
+                    rpc, [f"{space}{n}" for n in range(batch_n, batch_n + BATCH)]
+                )
+                for batch_n in range(
+                    window, min(window + BATCH * concurrency, stop + 1), BATCH
+                )
+            ]
+        )
+        yield {k: v for batch in batches for k, v in batch.items()}
+
+
+def asset_row(token, get_obj):
+    """
+    assets table row of a 1.3.x object
+    """
+    desc = ""
+    with contextlib.suppress(Exception):
+        desc = json.loads(get_obj["options"]["description"])["short_name"]
+    pool_id = get_obj.get("for_liquidity_pool", "")
+    bitasset_id = get_obj.get("bitasset_data_id", "")
+    asset_type = "mpa" if bitasset_id else "lp" if pool_id else "uia"
+    return (
+        token,
+        get_obj["dynamic_asset_data_id"],
+        pool_id,
+        bitasset_id,
+        get_obj["symbol"],
+        get_obj["precision"],
+        get_obj["options"]["market_fee_percent"],
+        get_obj["options"]["extensions"].get(
+            "taker_fee_percent",
+            get_obj["options"]["market_fee_percent"],
+        ),
+        desc,
+        asset_type,
+    )
+
+
+def pool_row(sql, token, get_obj):
+    """
+    pools table row of a 1.19.x object, asset names come from the metadata cache
+    """
+    asset_a_data = METADATA.asset(sql, get_obj["asset_a"])
+    asset_b_data = METADATA.asset(sql, get_obj["asset_b"])
+    asset_a_name = asset_a_data["symbol"]
+    asset_b_name = asset_b_data["symbol"]
+    asset_a_prec = asset_a_data["precision"]
+    asset_b_prec = asset_b_data["precision"]
+    share_asset_name = name_id_lookup(sql, get_obj["share_asset"])
+    return (
+        token,
+        get_obj["asset_a"],
+        get_obj["asset_b"],
+        asset_a_name,
+        asset_b_name,
+        float(int(get_obj["balance_a"]) / 10**asset_a_prec),
+        float(int(get_obj["balance_b"]) / 10**asset_b_prec),
+        get_obj["share_asset"],
+        share_asset_name,
+        get_obj["taker_fee_percent"],
+        get_obj["withdrawal_fee_percent"],
+        int(get_obj["virtual_value"]) / 10 ** (asset_a_prec + asset_b_prec),
+        f"{asset_a_name}:{asset_b_name}",
+        f"{asset_a_name}:{asset_b_name}:{share_asset_name}",
+        0,
+        0,
+    )
+
+
+async def assets(rpc, sql, concurrency=CONCURRENCY):
     """
     initialize the assets database
     """
-    sql = Sql()
-    rpc = await wss_handshake()
     max_object = await get_max_object(rpc, "1.3.")
-    query = "SELECT id FROM assets;"  #'SELECT * FROM nodes'
-    # 'SELECT * FROM 1.3'
-    max_object_sql = sql.execute(query)
-    # print(max_object_sql)
-    max_object_sql = int(
-        max(max_object_sql, key=lambda x: int(x["id"][4:]))["id"][4:]
-        if max_object_sql
-        else -1
-    )
-    get_objs = {}
-    for batch_n in range(max_object_sql + 1, max_object + BATCH, BATCH):
-        get_objs = {
-            **get_objs,
-            **await rpc_get_objects(
-                rpc, [f"1.3.{str(n)}" for n in range(batch_n, batch_n + 100)]
-            ),
-        }
-        time.sleep(0.5)
-    inserts = []
-    for token, get_obj in get_objs.items():
-        desc = ""
-        with contextlib.suppress(Exception):
-            desc = json.loads(get_obj["options"]["description"])["short_name"]
-        inserts.append(
-            (
-                "INSERT INTO assets VALUES (?,?,?,?,?,?,?,?,?) ",
-                (
-                    token,
-                    get_obj["dynamic_asset_data_id"],
-                    get_obj.get("for_liquidity_pool", ""),
-                    get_obj.get("bitasset_data_id", ""),
-                    get_obj["symbol"],
-                    get_obj["precision"],
-                    get_obj["options"]["market_fee_percent"],
-                    get_obj["options"]["extensions"].get(
-                        "taker_fee_percent",
-                        get_obj["options"]["market_fee_percent"],
-                    ),
-                    desc,
-                ),
-            )
+    start = checkpoint(sql, "assets", "1.3.") + 1
+    async for get_objs in fetch_objects(rpc, "1.3.", start, max_object, concurrency):
+        rows = [asset_row(token, get_obj) for token, get_obj in get_objs.items()]
+        sql.executemany(
+            "INSERT OR REPLACE INTO assets VALUES (?,?,?,?,?,?,?,?,?,?)", rows
         )
-    if inserts:
-        queries = []
-        for update in inserts:
-            dml = {"query": update[0], "values": update[1]}
-            queries.append(dml)
-        sql.execute(queries)
+        print(f"assets synced to 1.3.{checkpoint(sql, 'assets', '1.3.')}")
+    METADATA.invalidate()
 
 
-def pools():
+async def pools(rpc, sql, concurrency=CONCURRENCY):
     """
     initialize the pools database
     """
-    sql = Sql()
-    rpc = await wss_handshake()
     max_object = await get_max_object(rpc, "1.19.")
-    query = "SELECT id FROM pools;"
-    max_object_sql = sql.execute(query)
-    # print(max_object_sql)
-    max_object_sql = int(
-        max(max_object_sql, key=lambda x: int(x["id"][5:]))["id"][5:]
-        if max_object_sql
-        else -1
-    )
-    get_objs = {}
-    for batch_n in range(max_object_sql + 1, max_object + BATCH, BATCH):
-        get_objs = {
-            **get_objs,
-            **await rpc_get_objects(
-                rpc, [f"1.19.{str(n)}" for n in range(batch_n, batch_n + 100)]
-            ),
-        }
-        time.sleep(0.5)
-    inserts = []
-    for token, get_obj in get_objs.items():
-        query = [
-            {
-                "query": "SELECT symbol, precision FROM assets WHERE id=?",
-                "values": (get_obj["asset_a"],),
-            }
-        ]
-        asset_a_data = sql.execute(query)[0]
-        query = [
-            {
-                "query": "SELECT symbol, precision FROM assets WHERE id=?",
-                "values": (get_obj["asset_b"],),
-            }
-        ]
-        asset_b_data = sql.execute(query)[0]
-        asset_a_name = asset_a_data["symbol"]
-        asset_b_name = asset_b_data["symbol"]
-        asset_a_prec = asset_a_data["precision"]
-        asset_b_prec = asset_b_data["precision"]
-        share_asset_name = name_id_lookup(sql, get_obj["share_asset"])
-        inserts.append(
-            (
-                "INSERT INTO pools VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?) ",
-                (
-                    token,
-                    get_obj["asset_a"],
-                    get_obj["asset_b"],
-                    asset_a_name,
-                    asset_b_name,
-                    float(int(get_obj["balance_a"]) / 10**asset_a_prec),
-                    float(int(get_obj["balance_b"]) / 10**asset_b_prec),
-                    get_obj["share_asset"],
-                    share_asset_name,
-                    get_obj["taker_fee_percent"],
-                    get_obj["withdrawal_fee_percent"],
-                    int(get_obj["virtual_value"]) / 10 ** (asset_a_prec + asset_b_prec),
-                    f"{asset_a_name}:{asset_b_name}",
-                    f"{asset_a_name}:{asset_b_name}:{share_asset_name}",
-                ),
-            )
+    start = checkpoint(sql, "pools", "1.19.") + 1
+    METADATA.load(sql)
+    async for get_objs in fetch_objects(rpc, "1.19.", start, max_object, concurrency):
+        rows = [pool_row(sql, token, get_obj) for token, get_obj in get_objs.items()]
+        sql.executemany(
+            "INSERT OR REPLACE INTO pools VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            rows,
         )
-    if inserts:
-        queries = []
-        for update in inserts:
-            dml = {"query": update[0], "values": update[1]}
-            queries.append(dml)
-        sql.execute(queries)
+        print(f"pools synced to 1.19.{checkpoint(sql, 'pools', '1.19.')}")
+    METADATA.invalidate()
+
+
+async def main(concurrency=CONCURRENCY):
+    """
+    sync every asset then every pool over one shared connection
+    """
+    start = time.time()
+    sql = Sql()
+    sql.upgrade()
+    rpc = await wss_handshake()
+    try:
+        await assets(rpc, sql, concurrency)
+        await pools(rpc, sql, concurrency)
+    finally:
+        await rpc.close()
+    print(f"catalog synced in {time.time() - start:.1f} seconds")
 
 
 if __name__ == "__main__":
-    assets()
-    pools()
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else CONCURRENCY))
@@ -11,9 +11,8 @@ that can be easily inserted with JS
 """
 
 # BITSHARES DEX UX MODULES
-from rpc import rpc_ticker
+from rpc import rpc_ticker, rpc_tickers
 from utilities import no_sci
-import asyncio
 
 
 async def orderbook_to_html(rpc, data, asset, currency, pool_data, pair):
@@ -122,7 +121,7 @@ async def build_last_price_section(rpc, pool_data, pair, asset, currency):
     ticker = (
         {
             "percent_change": 0,
-            "base_volume": 0,
+            "base_volume": pool_data.get("volume_b") or 0,
             "latest": pool_data["balance_a"] / pool_data["balance_b"],
         }
         if pool_data
@@ -144,31 +143,44 @@ async def build_last_price_section(rpc, pool_data, pair, asset, currency):
 
 #########################################
 async def create_asset_list(rpc, data, first_choice, base_asset, fast):
-    list_of_assets = []
+    unique, seen = [], set()
     for result in data:
-        if result["symbol"] not in [i["symbol"] for i in list_of_assets]:
-            # get_ticker for each pair
-            if (not fast) and (not first_choice) and ("xyk" not in result.keys()):
-                ticker = await rpc_ticker(rpc, f"{base_asset}:" + result["symbol"])
-                await asyncio.sleep(0)
-            else:
-                ticker = {
-                    "percent_change": 0,
-                    "base_volume": 0,
-                    "latest": 0,
-                }
-            print(ticker)
-            list_of_assets.append(
-                {
-                    "symbol": result["symbol"],
-                    "change": float(ticker["percent_change"]),
-                    "ticker": no_sci(float(ticker["latest"])),
-                    "volume": str(ticker["base_volume"]),
-                    "ispool": "xyk" in result.keys(),
-                    "id": result["id"] if ("xyk" in result.keys()) else "",
-                    "greyscale": result["greyscale"],
-                }
-            )
+        if result["symbol"] not in seen:
+            seen.add(result["symbol"])
+            unique.append(result)
+    # get_ticker for each pair, all at once
+    priced = [
+        (not fast) and (not first_choice) and ("xyk" not in result.keys())
+        for result in unique
+    ]
+    tickers = iter(
+        await rpc_tickers(
+            rpc,
+            [
+                f"{base_asset}:" + result["symbol"]
+                for result, price in zip(unique, priced)
+                if price
+            ],
+        )
+    )
+    list_of_assets = []
+    for result, price in zip(unique, priced):
+        ticker = (next(tickers) if price else None) or {
+            "percent_change": 0,
+            "base_volume": 0,
+            "latest": 0,
+        }
+        list_of_assets.append(
+            {
+                "symbol": result["symbol"],
+                "change": float(ticker["percent_change"]),
+                "ticker": no_sci(float(ticker["latest"])),
+                "volume": str(ticker["base_volume"]),
+                "ispool": "xyk" in result.keys(),
+                "id": result["id"] if ("xyk" in result.keys()) else "",
+                "greyscale": result["greyscale"],
+            }
+        )
     list_of_assets.sort(
         key=lambda x: (
             float(x["greyscale"]),
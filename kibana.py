@@ -10,6 +10,7 @@ and parse the discrete data that is received into candles
 """
 # STANDARD MOUDLES
 import asyncio
+import contextlib
 import json
 import time
 from bisect import bisect
@@ -18,19 +19,40 @@ import aiohttp
 
 # BITSHARES DEX UX MODULES
 from config import (
+    KIBANA_AGGREGATE,
     KIBANA_BATCH,
     KIBANA_CANDLE_LIFE,
     KIBANA_CLIP,
     KIBANA_HISTORY,
+    KIBANA_MIN_WINDOW,
     KIBANA_OVERLAP,
-    KIBANA_SLEEP,
+    KIBANA_PAGE,
+    KIBANA_PIT,
+    KIBANA_PIT_KEEP_ALIVE,
+    KIBANA_RECENT,
+    KIBANA_SYNC_ATTEMPTS,
+    KIBANA_WINDOWS,
+    KIBANA_WORKERS,
 )
-from database import Sql
-from kibana_queries import kibana_fills, kibana_swaps
+from database import AsyncSql, Sql
+from kibana_queries import kibana_candles, kibana_fills, kibana_swaps
 from rpc import lookup_account_names
-from sql_utils import id_name_lookup, precision
+from sql_utils import (
+    CANDLE_COLUMNS,
+    INTERVALS,
+    canonical_market,
+    id_name_lookup,
+    precision,
+    read_market,
+    upsert_candles,
+    upsert_trades,
+)
 from utilities import it, to_iso_date
 
+KIBANA_URL = "https://es.bts.mobi"
+KIBANA_INDEX = "bitshares-*"
+# market -> asyncio.Lock, one candle sync per market at a time in this process
+MARKET_LOCKS = {}
 
 # THIRD PARTY MODULES
 
@@ -65,73 +87,223 @@ def make_candles(data, interval):
     ]
 
 
-def get_end_unix(sql, market):
+async def get_end_unix(sql, market):
     """
     query how old the sql database data is for this market
     """
     query = [{"query": "SELECT end_unix FROM klines where pair=?", "values": (market,)}]
-    return sql.execute(query)[0]["end_unix"]
+    return (await sql.execute(query))[0]["end_unix"]
+
+
+def windows(start, stop, count):
+    """
+    split start to stop, in milliseconds, into about count disjoint windows
+    of whole seconds, newest first; block times are whole seconds, so no trade
+    falls between; a short range, like an incremental refresh, stays a single window
+    """
+    first, last = start // 1000, stop // 1000
+    step = max(KIBANA_MIN_WINDOW, (last - first + 1) // count)
+    return [
+        (max(second - step + 1, first) * 1000, second * 1000)
+        for second in range(last, first - 1, -step)
+    ]
+
+
+async def kibana_search(session, params):
+    """
+    send one elastic search query to kibana and return the decoded response
+    a query under a point in time names no index, the point in time does
+    """
+    index = "" if "pit" in params else f"/{KIBANA_INDEX}"
+    async with session.get(
+        f"{KIBANA_URL}{index}/_search",
+        data=json.dumps(params),
+        headers={"Content-Type": "application/json"},
+    ) as response:
+        return await response.json()
+
+
+@contextlib.asynccontextmanager
+async def point_in_time(session):
+    """
+    a point in time id for the searches of one history fetch, None without KIBANA_PIT
+    """
+    if not KIBANA_PIT:
+        yield None
+        return
+    async with session.post(
+        f"{KIBANA_URL}/{KIBANA_INDEX}/_pit?keep_alive={KIBANA_PIT_KEEP_ALIVE}"
+    ) as response:
+        pit = (await response.json())["id"]
+    try:
+        yield pit
+    finally:
+        async with session.delete(
+            f"{KIBANA_URL}/_pit",
+            data=json.dumps({"id": pit}),
+            headers={"Content-Type": "application/json"},
+        ):
+            pass
+
+
+async def fetch_window(
+    session, workers, sql, market, window, budget, after=None, pit=None
+):
+    """
+    the newest trades in market within window, a (start, stop) in milliseconds,
+    at least budget of them when there are that many, else every one
+    a full page continues from its last hit with search_after; if the rest of the
+    window spans more than a second its older half is split off and searched
+    only when the newer half falls short of the budget, so no hit is downloaded
+    twice, nor any beyond the page which fills the budget
+    """
+    start, stop = window
+    async with workers:
+        data = await kibana_search(
+            session,
+            kibana_swaps(market, start, stop, after, pit)
+            if market.startswith("1.19.")
+            else kibana_fills(market, start, stop, after, pit),
+        )
+    hits = data["hits"]["hits"]
+    if not hits:
+        return []
+    trades = await sql.run(parse_price_history, data)
+    # hits are newest first, so a page holding the budget holds the newest trades
+    if len(hits) < KIBANA_PAGE or len(trades) >= budget:
+        return trades
+    budget -= len(trades)
+    after = hits[-1]["sort"]
+    pit = data.get("pit_id", pit)
+    middle = (start + after[0]) // 2000 * 1000
+    newer = (middle, stop) if middle > start else window
+    part = await fetch_window(session, workers, sql, market, newer, budget, after, pit)
+    trades.extend(part)
+    if middle > start and len(part) < budget:
+        older = (start, middle - 1000)
+        trades.extend(
+            await fetch_window(
+                session, workers, sql, market, older, budget - len(part), None, pit
+            )
+        )
+    return trades
 
 
 async def get_trade_history(sql, market, start, stop):
     """
     Retrieve the trade history from kibana
     for a specified market within the specified time range.
+    The range is split into KIBANA_WINDOWS which are searched newest first,
+    in waves of 1, 2, 4... up to KIBANA_WORKERS concurrent windows, and any window
+    with a full page is split again. No older window is searched once
+    KIBANA_BATCH trades are in, nor is a window paged past the trades still needed.
     Parameters:
-    sql (sqlite3 connection object): An established sqlite3 connection object.
+    sql (AsyncSql): An awaitable database interface.
     market (str): The market name.
     start (int): Start time in Unix timestamp format.
     stop (int): Stop time in Unix timestamp format.
     Returns:
-    list: A list of trade history data, if any was found, else an empty list
+    list: The newest KIBANA_BATCH trades, newest first, else an empty list
     """
     # Check if data is old enough to refresh
-    sql_end_unix = get_end_unix(sql, market)
+    sql_end_unix = await get_end_unix(sql, market)
     if stop - sql_end_unix < (KIBANA_CANDLE_LIFE):
         print("DEBUG: KIBANA: candles are not old enough for kibana query")
         return []
-    start = start * 1000
-    stop = stop * 1000
-    final = []
-    pdata = {}
+    workers = asyncio.Semaphore(KIBANA_WORKERS)
+    pending = windows(int(start * 1000), int(stop * 1000), KIBANA_WINDOWS)
+    trades = {}
+    async with aiohttp.ClientSession() as session:
+        async with point_in_time(session) as pit:
+            # every trade of a wave is newer than those of the waves after it
+            # waves double from a single window, a busy market stops after the first
+            size = 1
+            while pending and len(trades) < KIBANA_BATCH:
+                wave, pending = pending[:size], pending[size:]
+                size = min(size * 2, KIBANA_WORKERS)
+                budget = KIBANA_BATCH - len(trades)
+                fetched = await asyncio.gather(
+                    *[
+                        fetch_window(
+                            session, workers, sql, market, window, budget, None, pit
+                        )
+                        for window in wave
+                    ]
+                )
+                # every hit is fetched once, this only guards against reindexing
+                trades.update(
+                    {trade[5]: trade for window in fetched for trade in window}
+                )
+    print(it("purple", f"[DEBUG]: KIBANA: Length of return list: {len(trades)}"))
+    return sorted(trades.values(), key=lambda x: x[0], reverse=True)[:KIBANA_BATCH]
+
+
+async def aggregate_candles(session, workers, market, window, interval, precisions):
+    """
+    the candles of one interval within window, bucketed by elastic search
+    each with the time and block of its last trade for the sync cursor
+    candles are stamped with the end of their bucket, as discrete_to_candles() does
+    """
+    async with workers:
+        data = await kibana_search(
+            session, kibana_candles(market, *window, interval, precisions)
+        )
+    return [
+        {"time": bucket["key"] + interval * 1000, **bucket["ohlcv"]["value"]}
+        for bucket in data["aggregations"]["candles"]["buckets"]
+        if bucket["ohlcv"]["value"]
+    ]
 
+
+async def backfill_candles(sql, market, data, start, stop):
+    """
+    replace the candles of every interval from start to stop, in seconds,
+    with candles aggregated by elastic search
+    each interval only covers the KIBANA_CLIP buckets which are kept,
+    stored buckets from before that are left as they were
+    raises, leaving data untouched, if any aggregation fails
+    :return: the data and the sync cursor (last_unix, last_block), or None
+    """
+    precisions = [
+        await sql.run(precision, i) for i in canonical_market(market).split(":")
+    ]
+    windows_by_interval = {
+        interval: (
+            int(max(start, stop - KIBANA_CLIP * interval) * 1000),
+            int(stop * 1000),
+        )
+        for interval in INTERVALS
+    }
+    workers = asyncio.Semaphore(KIBANA_WORKERS)
     async with aiohttp.ClientSession() as session:
-        while True:
-            params = (
-                kibana_swaps(market, start, stop)
-                if market.startswith("1.19.")
-                else kibana_fills(market, start, stop)
-            )
-            # Send the kibana query
-            async with session.get(
-                "https://es.bts.mobi/bitshares-*/_search",
-                data=json.dumps(params),
-                headers={"Content-Type": "application/json"},
-            ) as response:
-                data = await response.json()
-                # print(data)
-            # Stop if there's no new data,
-            # the data is the same as the previous query,
-            # or if the batch size has been reached
-            if (
-                (len(data["hits"]["hits"]) <= 1)
-                or (pdata == data)
-                or (len(final) >= KIBANA_BATCH)
-            ):
-                break
-            pdata = data
-            print(it("purple", f"[DEBUG]: KIBANA: Length of return list: {len(final)}"))
-            data = parse_price_history(sql, data)
-            final.extend(data)
-            stop = sorted(data, key=lambda x: x[0])[0][0]
-            # Wait before sending another query
-            await asyncio.sleep(KIBANA_SLEEP)
-    return final
+        fetched = await asyncio.gather(
+            *[
+                aggregate_candles(
+                    session, workers, market, window, interval, precisions
+                )
+                for interval, window in windows_by_interval.items()
+            ]
+        )
+    # built apart and swapped in at the end, a malformed bucket leaves data as it was
+    replaced = {
+        f"c{interval}": [i for i in data[f"c{interval}"] if i["time"] <= window[0]]
+        + [{k: i[k] for k in CANDLE_COLUMNS} for i in candles]
+        for (interval, window), candles in zip(windows_by_interval.items(), fetched)
+    }
+    last = max(
+        (i for candles in fetched for i in candles),
+        key=lambda x: x["last_unix"],
+        default=None,
+    )
+    cursor = (last["last_unix"] // 1000, last["last_block"]) if last else None
+    data.update(replaced)
+    return data, cursor
 
 
 def format_raw_history_data(data):
     """
     make the returned kibana data indexing for swaps and fills identical
+    keyed by op_id, many operations share the timestamp of their block
     """
     data = json.loads(
         json.dumps(data)
@@ -140,7 +312,7 @@ def format_raw_history_data(data):
         .replace("operation_history.operation_result.keyword", "operation_history.op")
     )
     data = {
-        i["sort"][0]: {
+        i["fields"]["account_history.operation_id"][0]: {
             **{
                 k: v[0] if isinstance(v, list) else v
                 for k, v in json.loads(
@@ -151,6 +323,7 @@ def format_raw_history_data(data):
             "account": i["fields"]["account_history.account.keyword"][0],
             "blocknum": i["fields"]["block_data.block_num"][0],
             "op_id": i["fields"]["account_history.operation_id"][0],
+            "unix": i["sort"][0],
         }
         for i in data["hits"]["hits"]
     }
@@ -168,13 +341,13 @@ def process_operations_history(sql, data):
     """
     precision_map = {}
     processed_data = {}
-    for timestamp, operation in data.items():
+    for op_id, operation in data.items():
         for direction in ["paid", "received"]:
             if operation[direction]["asset_id"] not in precision_map:
                 precision_map[operation[direction]["asset_id"]] = precision(
                     sql, operation[direction]["asset_id"]
                 )
-        processed_data[timestamp] = {
+        processed_data[op_id] = {
             **{
                 direction: {
                     "amount": float(operation[direction]["amount"])
@@ -186,6 +359,7 @@ def process_operations_history(sql, data):
             "account": operation["account"],
             "blocknum": operation["blocknum"],
             "op_id": operation["op_id"],
+            "unix": operation["unix"],
         }
     return processed_data
 
@@ -203,15 +377,12 @@ def parse_price_history(sql, data):
     """
     data = format_raw_history_data(data)
     data = process_operations_history(sql, data)
-    assets = [
-        list(data.values())[0]["paid"]["asset_id"],
-        list(data.values())[0]["received"]["asset_id"],
-    ]
-    assets = [int(i[4:]) for i in assets]
-    assets.sort()
-    assets = [f"1.3.{str(i)}" for i in assets]
+    first = list(data.values())[0]
+    assets = canonical_market(
+        f"{first['paid']['asset_id']}:{first['received']['asset_id']}"
+    ).split(":")
     data2 = []
-    for timestamp, operation in data.items():
+    for operation in data.values():
         price = (
             operation["paid"]["amount"] / operation["received"]["amount"]
             if (
@@ -228,7 +399,7 @@ def parse_price_history(sql, data):
         if price:
             data2.append(
                 [
-                    timestamp,
+                    operation["unix"],
                     price,
                     operation["received"]["amount"],
                     operation["account"],
@@ -237,7 +408,7 @@ def parse_price_history(sql, data):
                 ]
             )
         else:
-            print(timestamp, operation)
+            print(operation)
     return data2
 
 
@@ -316,17 +487,34 @@ def discrete_to_candles(discrete, size):
     ]
 
 
-def append_to_candles(data):
+def merge_candle(old, new):
+    """
+    a stored candle extended with a candle of later trades in the same bucket
+    """
+    if not old:
+        return new
+    return {
+        "time": new["time"],
+        "open": old["open"],
+        "high": max(old["high"], new["high"]),
+        "low": min(old["low"], new["low"]),
+        "close": new["close"],
+        "volume": old["volume"] + new["volume"],
+    }
+
+
+def append_to_candles(data, trades, merge):
     """
     This function updates the historical candlestick data for various time intervals.
     Parameters:
     data (dict): A dictionary of dictionaries with the following keys:
         ["discrete", "c900", "c1800", "c3600", "c7200", "c14400", "c43200", "c86400"]
-        The "discrete" key holds a list of discrete data points
-        of the format [unix, price, volume].
-        The other keys hold historical candlestick data of the given interval.
-        Each candlestick is a dictionary with keys:
+        The keys other than "discrete" hold historical candlestick data of the
+        given interval. Each candlestick is a dictionary with keys:
         ["open", "high", "low", "close", "volume", "time"]
+    trades (list): trades of the format [unix, price, volume, ...], oldest first
+    merge (bool): the trades are all new since the stored candles were made,
+        so they extend the stored buckets instead of replacing them
     Returns:
     dict: The updated dictionary of historical candlestick data.
     """
@@ -341,10 +529,15 @@ def append_to_candles(data):
     for interval in [900, 1800, 3600, 7200, 14400, 43200, 86400]:
         # candles is a list of kline dicts parsed from kibana
         period = f"c{str(interval)}"
-        if len(data["discrete"]) == 0:
+        if len(trades) == 0:
             candles = []
         else:
-            candles = make_candles(list(zip(*data["discrete"])), interval)
+            candles = make_candles(trades, interval)
+        if merge:
+            candles = [
+                merge_candle(sql_candles_by_unix[period].get(i["time"]), i)
+                for i in candles
+            ]
         candles_by_unix = {i["time"]: i for i in candles}
         candles_by_unix = {i: candles_by_unix[i] for i in sorted(candles_by_unix)}
         # data is a dictionary with keys
@@ -364,80 +557,211 @@ def append_to_candles(data):
     return data
 
 
-async def append_to_discrete(rpc, sql, market, data, start, inv):
+async def append_to_discrete(rpc, sql, market, data, start, inv, cursor):
     """
     This function retrieves recent trade history for a given market,
     appends the latest data to an existing data set
     :param rpc: Connection to the RPC server
     :type rpc: object
-    :param sql: Connection to the SQL database
-    :type sql: object
+    :param sql: Awaitable interface to the SQL database
+    :type sql: AsyncSql
     :param market: The market to retrieve trade history for
     :type market: str
     :param data: The existing data set to append to
     :type data: dict
-    :return: The updated data set with recent trade history and formatted for display
-    :rtype: dict
+    :param cursor: block number of the newest trade already in the candles
+    :type cursor: int
+    :return: The updated data set formatted for display, the stop time,
+        and the trades which are new since the cursor, oldest first
+    :rtype: tuple
     """
     stop = time.time() + 10  # always query a few seconds in the future
     startel = time.time()
     # retrieve recent trade history
     recent_data = await get_trade_history(sql, market, start, stop)
     print(time.time() - startel)
-    # unzip and add the recent data to the existing data set
-    data["discrete"] = [list(i) for i in zip(*data["discrete"])]
-    data["discrete"].extend(recent_data[:KIBANA_CLIP])
-    data["discrete"] = sorted(data["discrete"], key=lambda x: x[0])[:KIBANA_CLIP]
+    # the overlap before the cursor is fetched again, drop the trades already seen
+    # op_id is TEXT in the trades table, whatever type kibana returns it as
+    trades = {str(i[5]): list(i) for i in zip(*data["discrete"])}
+    new = sorted(
+        (i for i in recent_data if i[4] > cursor or str(i[5]) not in trades),
+        key=lambda x: x[0],
+    )
+    trades.update({str(i[5]): i for i in new})
+    # keep the newest KIBANA_CLIP trades, oldest first
+    data["discrete"] = sorted(trades.values(), key=lambda x: x[0])[-KIBANA_CLIP:]
     data["discrete"] = [list(i) for i in zip(*data["discrete"])]
     if len(data["discrete"]) == 0:
-        return data, stop
+        return data, stop, new
     # format the data for display
     if len(data["discrete"]) == 6:
         data["discrete"].append(await format_onhover(rpc, data["discrete"], inv))
     else:
         data["discrete"][6] = await format_onhover(rpc, data["discrete"], inv)
-    return data, stop
+    return data, stop, new
+
+
+def recent_split(now):
+    """
+    the last second aggregated by a backfill and the first second fetched as trades
+    both ranges are inclusive and block times are whole seconds,
+    so the boundary second is counted once
+    """
+    recent = int(now - KIBANA_RECENT)
+    return recent, recent + 1
+
+
+def sync_cursor(cursor, new):
+    """
+    the sync cursor (last_unix, last_block) once the new trades are in the candles
+    the overlap may return only trades indexed late, older than the cursor,
+    so the cursor never moves backwards
+    """
+    if not new:
+        return cursor
+    newest = (max(i[0] for i in new) // 1000, max(i[4] for i in new))
+    if cursor is None:
+        return newest
+    return (max(cursor[0], newest[0]), max(cursor[1], newest[1]))
 
 
-def update_database_candles(sql, market, data, stop):
+async def update_database_candles(sql, market, data, stop, stored, cursor, revision):
     """
-    Update the klines in the database with new data.
+    Update the candles and trades in the database with new data.
+    Only buckets and trades which differ from what was read are written.
     Parameters:
-        sql (object): SQL connection object
+        sql (AsyncSql): awaitable database interface
         market (str): Market symbol
         data (dict): Dictionary containing the updated data
+        stored (dict): the same data as read from the database, keyed by time/op_id
+        cursor (tuple): (last_unix, last_block) of the newest trade, or None
+        revision (int): the klines revision the stored data was read at
     Returns:
-        None
+        bool: False, and nothing written, if another sync wrote the market since
     """
     # Get the end_unix time from the database
-    sql_end_unix = get_end_unix(sql, market)
+    sql_end_unix = await get_end_unix(sql, market)
     # Check if the data is fresh enough to be updated
     if stop - sql_end_unix < (KIBANA_CANDLE_LIFE):
         stop = sql_end_unix
-    # Prepare the query for updating the klines
-    query = [
-        {
-            "query": (
-                "UPDATE klines "
-                "SET end_unix=?, c86400=?, c43200=?, c14400=?, "
-                "c7200=?, c3600=?, c1800=?, c900=?, discrete=? "
-                "WHERE pair=?"
-            ),
-            "values": (
-                stop,
-                json.dumps(data["c86400"]),
-                json.dumps(data["c43200"]),
-                json.dumps(data["c14400"]),
-                json.dumps(data["c7200"]),
-                json.dumps(data["c3600"]),
-                json.dumps(data["c1800"]),
-                json.dumps(data["c900"]),
-                json.dumps(data["discrete"]),
-                market,
-            ),
-        }
-    ]
-    sql.execute(query)
+    # claim the next revision, only if it is still the one the data was read at
+    # then advance the sync cursor to the newest trade in the candles
+    guard = {
+        "query": (
+            "UPDATE klines SET end_unix=?, revision=revision+1"
+            + (", last_unix=?, last_block=?" if cursor else "")
+            + " WHERE pair=? AND revision=?"
+        ),
+        "values": (stop, *(cursor or ()), market, revision),
+    }
+    query = []
+    for interval in INTERVALS:
+        period = f"c{interval}"
+        changed = [i for i in data[period] if i and stored[period].get(i["time"]) != i]
+        query.extend(upsert_candles(market, interval, changed))
+        if data[period]:
+            # forget the buckets which were clipped by KIBANA_CLIP
+            query.append(
+                {
+                    "query": (
+                        "DELETE FROM candles WHERE pair=? AND interval=? AND time<?"
+                    ),
+                    "values": (market, interval, data[period][0]["time"]),
+                }
+            )
+    trades = [list(i) for i in zip(*data["discrete"])]
+    changed = [i for i in trades if stored["discrete"].get(i[5]) != tuple(i)]
+    query.extend(upsert_trades(market, changed))
+    if trades:
+        query.append(
+            {
+                "query": "DELETE FROM trades WHERE pair=? AND (time<? OR time>?)",
+                "values": (market, trades[0][0], trades[-1][0]),
+            }
+        )
+    return await sql.run(Sql.write_if, guard, query, write=True)
+
+
+async def sync_candles(rpc, sql, market, inv):
+    """
+    bring the stored candles and trades of market up to date with kibana
+    the cursor and candles are read from one snapshot and written back only if
+    no other sync wrote the market in between, else the sync starts over;
+    within this process syncs of one market wait on each other instead
+    :return: the candles of every interval and the discrete trades
+    """
+    async with MARKET_LOCKS.setdefault(market, asyncio.Lock()):
+        for _ in range(KIBANA_SYNC_ATTEMPTS):
+            candles_sql, written = await sync_candles_once(rpc, sql, market, inv)
+            if written:
+                break
+            print(it("orange", f"[KIBANA] {market} was synced elsewhere, again"))
+    return candles_sql
+
+
+async def sync_candles_once(rpc, sql, market, inv):
+    """
+    one read, merge and conditional write of the candles of market
+    :return: the candles and whether they were written
+    """
+    result, candles_sql = await sql.run(read_market, market)
+    # snapshot of the stored data so that only changes are written back
+    stored = {
+        "discrete": {i[5]: i for i in zip(*candles_sql["discrete"])},
+        **{
+            period: {i["time"]: i for i in candles}
+            for period, candles in candles_sql.items()
+            if period != "discrete"
+        },
+    }
+    # If data was synced before, resume from the sync cursor, otherwise use 1 year ago
+    # candles from before the cursor existed are rebuilt once from a year of trades
+    cursor = (result["last_block"] or 0) if result else 0
+    revision = (result["revision"] or 0) if result else 0
+    synced = None
+    if cursor and candles_sql["c86400"]:
+        synced = (result["last_unix"], cursor)
+        start = result["last_unix"] - KIBANA_OVERLAP
+    else:
+        # If no data exists, create a new row in the database
+        if not result:
+            print("Creating a row for", market)
+            query = [
+                {
+                    "query": (
+                        "INSERT OR IGNORE INTO klines (pair, end_unix) VALUES (?, ?)"
+                    ),
+                    "values": (market, time.time() - KIBANA_CANDLE_LIFE),
+                }
+            ]
+            await sql.execute(query)
+        start = time.time() - KIBANA_HISTORY
+        # pools trade amounts are only in the operation result text, which elastic
+        # search cannot aggregate, so pools are always backfilled from trades
+        # backfill_candles() only replaces the candles once every interval is in,
+        # so when the aggregation fails the year of trades is fetched instead
+        if KIBANA_AGGREGATE and not market.startswith("1.19."):
+            recent, after = recent_split(time.time())
+            try:
+                candles_sql, synced = await backfill_candles(
+                    sql, market, candles_sql, start, recent
+                )
+                start = after
+            except Exception as error:
+                print(
+                    it("orange", f"[KIBANA] {market} aggregation failed: {error!r}")
+                )
+    # Update the candle data in the database
+    candles_sql, stop, new = await append_to_discrete(
+        rpc, sql, market, candles_sql, start, inv, cursor
+    )
+    # trades after an aggregated backfill extend its buckets like those after a cursor
+    candles_sql = append_to_candles(candles_sql, new, bool(cursor or synced))
+    synced = sync_cursor(synced, new)
+    written = await update_database_candles(
+        sql, market, candles_sql, stop, stored, synced, revision
+    )
+    return candles_sql, written
 
 
 async def fetch_candles(ws, rpc, market, chart_type, candle_size):
@@ -451,54 +775,18 @@ async def fetch_candles(ws, rpc, market, chart_type, candle_size):
         dict: The candle data, with keys are period and values being the list of data.
     """
 
-    sql = Sql()
+    sql = AsyncSql()
     # Get the market name in the required format
     if not market.startswith("1.19"):
         # the market is asset_id:currency_id for this kline trading pair
-        market = ":".join([id_name_lookup(sql, i) for i in market.split(":")])
-        # in the database the klines are stored oldest token first, regardless of the user request
-        sql_market = ":".join(
-            [
-                f"1.3.{x}"
-                for x in sorted(
-                    [int(i[4:]) for i in market.split(":")]
-                )
-            ]
+        market = ":".join(
+            [await sql.run(id_name_lookup, i) for i in market.split(":")]
         )
+        # in the database the klines are stored oldest token first, regardless of the user request
+        sql_market = canonical_market(market)
     else:
         sql_market = market
-    # Get the data from the SQL database
-    query = [{"query": "SELECT * FROM klines WHERE pair=?", "values": (market,)}]
-    result = sql.execute(query)
-    # If data exists in the database, use it as the start time, otherwise use 1 year ago
-    if result and (result[0]["c86400"] is not None):
-
-        start = result[0]["end_unix"] - KIBANA_OVERLAP
-        candles_sql = {
-            k: v for k, v in result[0].items() if k.startswith("c") or k == "discrete"
-        }
-    else:
-        # If no data exists, create a new row in the database
-        if not result:
-            print("Creating a row for", market)
-            query = [
-                {
-                    "query": "INSERT INTO klines (pair, end_unix) VALUES (?, ?)",
-                    "values": (market, time.time() - KIBANA_CANDLE_LIFE),
-                }
-            ]
-            sql.execute(query)
-        start = time.time() - KIBANA_HISTORY
-        candles_sql = {
-            "discrete": [],
-            **{f"c{i}": [] for i in [900, 1800, 3600, 7200, 14400, 43200, 86400]},
-        }
-    # Update the candle data in the database
-    candles_sql, stop = await append_to_discrete(
-        rpc, sql, market, candles_sql, start, market != sql_market
-    )
-    candles_sql = append_to_candles(candles_sql)
-    update_database_candles(sql, market, candles_sql, stop)
+    candles_sql = await sync_candles(rpc, sql, market, market != sql_market)
     # Rename the fields for compatibility with different charting libraries
     ret = {
         period: candles_sql[period]
@@ -581,3 +869,41 @@ def format_chart_type(chart_type, data):
         ret,
         key=lambda x: x["time"] if chart_type in ["candle", "line"] else x["timestamp"],
     )
+
+
+def unit_test():
+    """
+    a resumed sync which only gets trades older than its cursor keeps the cursor
+    """
+    # [unix ms, price, volume, account, blocknum, op_id]
+    late = [[1_000_000, 1.0, 2.0, "1.2.1", 400, "1.11.7"]]
+    newer = [[1_030_000, 1.1, 3.0, "1.2.2", 410, "1.11.9"]]
+    assert sync_cursor((1_020, 406), late) == (1_020, 406)
+    assert sync_cursor((1_020, 406), late + newer) == (1_030, 410)
+    assert sync_cursor((1_020, 406), []) == (1_020, 406)
+    assert sync_cursor(None, late) == (1_000, 400)
+    print("sync_cursor ok")
+    # trades at, around, and exactly on the boundary of an aggregated backfill
+    recent, start = recent_split(10_000 + KIBANA_RECENT)
+    trades = [
+        [second * 1000, 1.0 + second / 1e5, 1.0]
+        for second in range(recent - 1800, recent + 1800, 3)
+    ]
+    trades.append([recent * 1000, 2.0, 5.0])
+    trades.sort(key=lambda x: x[0])
+    for interval in INTERVALS:
+        # the aggregation is "lte" recent, the raw windows are "gte" their start
+        older = make_candles([i for i in trades if i[0] <= recent * 1000], interval)
+        raw = windows(start * 1000, (recent + 1800) * 1000, KIBANA_WINDOWS)
+        newer = make_candles(
+            [i for i in trades if raw[-1][0] <= i[0] <= raw[0][1]], interval
+        )
+        merged = {i["time"]: i for i in older}
+        for candle in newer:
+            merged[candle["time"]] = merge_candle(merged.get(candle["time"]), candle)
+        assert list(merged.values()) == make_candles(trades, interval), interval
+    print("recent_split boundary bucket ok")
+
+
+if __name__ == "__main__":
+    unit_test()
@@ -4,23 +4,45 @@
  ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
 Bitshares Decentralized Exchange User Experience
 """
+# BITSHARES DEX UX MODULES
+from config import KIBANA_PAGE, KIBANA_PIT_KEEP_ALIVE
 from utilities import to_iso_date
 
+# newest first; block number and operation id break ties between hits in one block
+# account_history.operation_id is the "1.11.x" text, operation_id_num its number
+# so that every hit has a unique sort key for search_after to continue from
+SORT = [
+    {
+        "block_data.block_time": {
+            "order": "desc",
+            "unmapped_type": "boolean",
+        }
+    },
+    {"block_data.block_num": {"order": "desc", "unmapped_type": "long"}},
+    {"operation_id_num": {"order": "desc", "unmapped_type": "long"}},
+]
 
-def kibana_swaps(market, start, stop):
+
+def paginate(query, after=None, pit=None):
+    """
+    continue query from the sort key of the last hit of the previous page
+    optionally under a point in time, which then replaces the index in the url
+    """
+    if after is not None:
+        query["search_after"] = after
+    if pit is not None:
+        query["pit"] = {"id": pit, "keep_alive": KIBANA_PIT_KEEP_ALIVE}
+    return query
+
+
+def kibana_swaps(market, start, stop, after=None, pit=None):
     """
     formatted liquidity pool swap history elastic search query
+    after and pit are the search_after cursor and point in time id, see paginate()
     """
-    return {
+    query = {
         "track_total_hits": False,
-        "sort": [
-            {
-                "block_data.block_time": {
-                    "order": "desc",
-                    "unmapped_type": "boolean",
-                }
-            }
-        ],
+        "sort": SORT,
         "fields": [
             {
                 "field": "operation_history.operation_result.keyword",
@@ -39,7 +61,7 @@ def kibana_swaps(market, start, stop):
                 "include_unmapped": "false",
             },
         ],
-        "size": 10000,
+        "size": KIBANA_PAGE,
         "version": True,
         "script_fields": {},
         "stored_fields": ["*"],
@@ -49,25 +71,9 @@ def kibana_swaps(market, start, stop):
             "bool": {
                 "must": [],
                 "filter": [
-                    {
-                        "bool": {
-                            "filter": [
-                                {
-                                    "multi_match": {
-                                        "type": "best_fields",
-                                        "query": market,
-                                        "lenient": True,
-                                    }
-                                },
-                                {
-                                    "bool": {
-                                        "should": [{"match": {"operation_type": "63"}}],
-                                        "minimum_should_match": 1,
-                                    }
-                                },
-                            ]
-                        }
-                    },
+                    # exact keyword matches, in filter context they are not scored
+                    {"term": {"operation_type": 63}},
+                    {"term": {"operation_history.op_object.pool.keyword": market}},
                     {
                         "range": {
                             "block_data.block_time": {
@@ -87,29 +93,24 @@ def kibana_swaps(market, start, stop):
         },
         "highlight": {"fragment_size": 2147483647},
     }
+    return paginate(query, after, pit)
 
 
-def kibana_fills(market, start, stop):
+def kibana_fills(market, start, stop, after=None, pit=None):
     """
     formatted order book fill history elastic search query
+    after and pit are the search_after cursor and point in time id, see paginate()
     """
-    return {
+    query = {
         "track_total_hits": False,
-        "sort": [
-            {
-                "block_data.block_time": {
-                    "order": "desc",
-                    "unmapped_type": "boolean",
-                }
-            }
-        ],
+        "sort": SORT,
         "fields": [
             {"field": "account_history.account.keyword"},
             {"field": "operation_history.op"},
             {"field": "account_history.operation_id"},
             {"field": "block_data.block_num"},
         ],
-        "size": 10000,
+        "size": KIBANA_PAGE,
         "version": True,
         "script_fields": {},
         "stored_fields": ["*"],
@@ -119,41 +120,20 @@ def kibana_fills(market, start, stop):
             "bool": {
                 "must": [],
                 "filter": [
+                    # exact keyword matches, in filter context they are not scored
+                    {"term": {"operation_type": 4}},
+                    # each fill is recorded for both sides, keep only the taker's
+                    {"term": {"operation_history.op_object.is_maker": False}},
                     {
-                        "bool": {
-                            "filter": [
-                                {
-                                    "multi_match": {
-                                        "type": "best_fields",
-                                        "query": market.split(":")[0],
-                                        "lenient": True,
-                                    }
-                                },
-                                {
-                                    "multi_match": {
-                                        "type": "best_fields",
-                                        "query": market.split(":")[1],
-                                        "lenient": True,
-                                    }
-                                },
-                                # operation_history.op_object.is_maker : false
-                                {
-                                    "multi_match": {
-                                        "type": "best_fields",
-                                        "query": (
-                                            "operation_history.op_object.is_maker :"
-                                            " false"
-                                        ),
-                                        "lenient": True,
-                                    }
-                                },
-                                {
-                                    "bool": {
-                                        "should": [{"match": {"operation_type": "4"}}],
-                                        "minimum_should_match": 1,
-                                    }
-                                },
-                            ]
+                        "terms": {
+                            "operation_history.op_object.fill_price.base.asset_id"
+                            ".keyword": market.split(":")
+                        }
+                    },
+                    {
+                        "terms": {
+                            "operation_history.op_object.fill_price.quote.asset_id"
+                            ".keyword": market.split(":")
                         }
                     },
                     {
@@ -174,3 +154,157 @@ def kibana_fills(market, start, stop):
         },
         "highlight": {"fragment_size": 2147483647},
     }
+    return paginate(query, after, pit)
+
+
+# painless scripts of the ohlcv scripted metric, one trade per document
+# the price and volume are those parse_price_history() computes in python;
+# open and close are the first and last trade by time, then operation id
+OHLCV_INIT = """
+state.count = 0; state.volume = 0.0;
+state.high = Double.NEGATIVE_INFINITY; state.low = Double.POSITIVE_INFINITY;
+state.open_t = Long.MAX_VALUE; state.open_op = Long.MAX_VALUE; state.open = 0.0;
+state.close_t = Long.MIN_VALUE; state.close_op = Long.MIN_VALUE; state.close = 0.0;
+state.block = 0L;
+"""
+OHLCV_MAP = """
+String paid = doc['operation_history.op_object.pays.asset_id.keyword'].value;
+String received = doc['operation_history.op_object.receives.asset_id.keyword'].value;
+double pays = doc['operation_history.op_object.pays.amount'].value
+    / Math.pow(10, paid == params.a0 ? params.p0 : params.p1);
+double receives = doc['operation_history.op_object.receives.amount'].value
+    / Math.pow(10, received == params.a0 ? params.p0 : params.p1);
+double price = 0;
+if (paid == params.a0 && received == params.a1) { price = pays / receives; }
+else if (paid == params.a1 && received == params.a0) { price = receives / pays; }
+if (price > 0) {
+    long t = doc['block_data.block_time'].value.toInstant().toEpochMilli();
+    long op = doc['operation_id_num'].value;
+    state.count += 1;
+    state.volume += receives;
+    state.high = Math.max(state.high, price);
+    state.low = Math.min(state.low, price);
+    if (t < state.open_t || (t == state.open_t && op < state.open_op)) {
+        state.open_t = t; state.open_op = op; state.open = price;
+    }
+    if (t > state.close_t || (t == state.close_t && op > state.close_op)) {
+        state.close_t = t; state.close_op = op; state.close = price;
+    }
+    state.block = Math.max(state.block, doc['block_data.block_num'].value);
+}
+"""
+OHLCV_REDUCE = """
+Map r = null;
+for (s in states) {
+    if (s == null || s.count == 0) { continue; }
+    if (r == null) { r = s; continue; }
+    r.count += s.count;
+    r.volume += s.volume;
+    r.high = Math.max(r.high, s.high);
+    r.low = Math.min(r.low, s.low);
+    if (s.open_t < r.open_t || (s.open_t == r.open_t && s.open_op < r.open_op)) {
+        r.open_t = s.open_t; r.open_op = s.open_op; r.open = s.open;
+    }
+    if (s.close_t > r.close_t || (s.close_t == r.close_t && s.close_op > r.close_op)) {
+        r.close_t = s.close_t; r.close_op = s.close_op; r.close = s.close;
+    }
+    r.block = Math.max(r.block, s.block);
+}
+if (r == null) { return null; }
+return ['open': r.open, 'high': r.high, 'low': r.low, 'close': r.close,
+    'volume': r.volume, 'last_unix': r.close_t, 'last_block': r.block];
+"""
+
+
+def kibana_candles(market, start, stop, interval, precisions):
+    """
+    order book fill candles of one interval, in seconds, aggregated by elastic search
+    the filters are those of kibana_fills(), but only the buckets are returned
+    precisions are those of the market's assets, oldest asset first
+    """
+    query = kibana_fills(market, start, stop)
+    for key in [
+        "sort",
+        "fields",
+        "version",
+        "script_fields",
+        "stored_fields",
+        "runtime_mappings",
+        "highlight",
+    ]:
+        query.pop(key)
+    assets = sorted(market.split(":"), key=lambda x: int(x[4:]))
+    query["size"] = 0
+    query["aggs"] = {
+        "candles": {
+            "date_histogram": {
+                "field": "block_data.block_time",
+                "fixed_interval": f"{interval}s",
+                "min_doc_count": 1,
+            },
+            "aggs": {
+                "ohlcv": {
+                    "scripted_metric": {
+                        "params": {
+                            "a0": assets[0],
+                            "a1": assets[1],
+                            "p0": precisions[0],
+                            "p1": precisions[1],
+                        },
+                        "init_script": OHLCV_INIT,
+                        "map_script": OHLCV_MAP,
+                        "combine_script": "return state",
+                        "reduce_script": OHLCV_REDUCE,
+                    }
+                }
+            },
+        }
+    }
+    return query
+
+
+def keyword_filters(query):
+    """
+    raise AssertionError unless every clause of query is an unscored filter
+    which matches a keyword, number, boolean, range or field exactly
+    """
+    clauses = query["query"]["bool"]
+    assert not clauses["must"] and not clauses["should"], clauses
+    for clause in clauses["filter"]:
+        (kind, body), *_ = clause.items()
+        assert kind in ("term", "terms", "range", "exists"), clause
+        if kind in ("term", "terms"):
+            (field, value), *_ = body.items()
+            values = value if kind == "terms" else [value]
+            # text needs the keyword subfield, else it is analyzed into tokens
+            assert all(not isinstance(i, str) for i in values) or field.endswith(
+                ".keyword"
+            ), clause
+
+
+def unit_test():
+    """
+    the fills, swaps and candles queries only filter on exact keyword terms
+    see kibana_queries_test.py for the hits they return against the old queries
+    """
+    market, pool = "1.3.0:1.3.1", "1.19.5"
+    fills = kibana_fills(market, 0, 1000)
+    swaps = kibana_swaps(pool, 0, 1000, after=[1, 2, 3], pit="pit")
+    candles = kibana_candles(market, 0, 1000, 900, [5, 4])
+    for query in (fills, swaps, candles):
+        keyword_filters(query)
+    base = "operation_history.op_object.fill_price.base.asset_id.keyword"
+    assert {"term": {"operation_type": 4}} in fills["query"]["bool"]["filter"]
+    assert {"terms": {base: market.split(":")}} in fills["query"]["bool"]["filter"]
+    assert {"term": {"operation_history.op_object.pool.keyword": pool}} in swaps[
+        "query"
+    ]["bool"]["filter"]
+    assert swaps["search_after"] == [1, 2, 3] and swaps["pit"]["id"] == "pit"
+    # the candles aggregate exactly the fills which kibana_fills() returns
+    assert candles["size"] == 0 and "sort" not in candles
+    assert fills["query"] == candles["query"]
+    print("kibana queries only filter on exact keyword terms")
+
+
+if __name__ == "__main__":
+    unit_test()
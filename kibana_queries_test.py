@@ -0,0 +1,156 @@
+"""
+ ╔╗ ┬┌┬┐┌─┐┬ ┬┌─┐┬─┐┌─┐┌─┐  ╔╦╗┌─┐─┐ ┬  ╦ ╦─┐ ┬
+ ╠╩╗│ │ └─┐├─┤├─┤├┬┘├┤ └─┐   ║║├┤ ┌┴┬┘  ║ ║┌┴┬┘
+ ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
+Bitshares Decentralized Exchange User Experience
+
+test only: compare the kibana query filters with the full text ones they replaced
+"""
+# STANDARD MOUDLES
+import json
+import re
+
+# BITSHARES DEX UX MODULES
+from kibana_queries import kibana_fills, kibana_swaps
+
+
+def legacy_query(kind, market):
+    """
+    the full text filters which kibana_fills() and kibana_swaps() used
+    before the keyword terms
+    """
+    if kind == "swaps":
+        clauses = [
+            {"multi_match": {"query": market}},
+            {"match": {"operation_type": "63"}},
+        ]
+    else:
+        clauses = [
+            {"multi_match": {"query": market.split(":")[0]}},
+            {"multi_match": {"query": market.split(":")[1]}},
+            {"multi_match": {"query": "operation_history.op_object.is_maker : false"}},
+            {"match": {"operation_type": "4"}},
+        ]
+    return {"query": {"bool": {"filter": clauses}}}
+
+
+def stand_in_search(query, docs):
+    """
+    the hits of query among docs, flattened field dicts, evaluated like elastic search
+    multi_match analyzes every field of every document for any query token,
+    term and terms compare one keyword field; range and sort are not evaluated
+    """
+
+    def tokens(text):
+        return set(re.findall(r"[\w.]+", str(text).lower()))
+
+    def matches(clause, doc):
+        kind, body = next(iter(clause.items()))
+        if kind == "bool":
+            return all(matches(i, doc) for i in body.get("filter", []))
+        if kind == "multi_match":
+            return bool(
+                tokens(body["query"]) & set().union(*map(tokens, doc.values()))
+            )
+        field, value = next(iter(body.items()))
+        field = field.removesuffix(".keyword")
+        if kind in ("term", "match"):
+            return str(doc.get(field)) == str(value)
+        if kind == "terms":
+            return doc.get(field) in value
+        if kind == "exists":
+            return value in doc
+        return kind == "range"
+
+    return [doc for doc in docs if matches(query["query"], doc)]
+
+
+def unit_test():
+    """
+    the keyword term filters return the hits the full text filters returned
+    for the market, over a fixture of fills, swaps and orders
+    """
+    market, pool = "1.3.0:1.3.1", "1.19.5"
+
+    def fill(op_id, pays, receives, maker, fee="1.3.0"):
+        op_object = {
+            "fee": {"asset_id": fee},
+            "pays": {"asset_id": pays},
+            "receives": {"asset_id": receives},
+            "fill_price": {"base": {"asset_id": pays}, "quote": {"asset_id": receives}},
+            "is_maker": maker,
+        }
+        return {
+            "operation_type": 4,
+            "account_history.operation_id": f"1.11.{op_id}",
+            "operation_history.op": json.dumps([4, op_object]),
+            "operation_history.op_object.is_maker": maker,
+            "operation_history.op_object.fee.asset_id": fee,
+            "operation_history.op_object.pays.asset_id": pays,
+            "operation_history.op_object.receives.asset_id": receives,
+            "operation_history.op_object.fill_price.base.asset_id": pays,
+            "operation_history.op_object.fill_price.quote.asset_id": receives,
+        }
+
+    def swap(op_id, pool_id, sells, buys):
+        return {
+            "operation_type": 63,
+            "account_history.operation_id": f"1.11.{op_id}",
+            "operation_history.op_object.pool": pool_id,
+            "operation_history.op_object.amount_to_sell.asset_id": sells,
+            "operation_history.op_object.min_to_receive.asset_id": buys,
+            "operation_history.operation_result": json.dumps(
+                [2, {"paid": [{"asset_id": sells}]}]
+            ),
+        }
+
+    # hits in the shape of the bitshares-* index, trimmed to the filtered fields
+    docs = [
+        # taker fills of the market, both directions
+        fill(1, "1.3.0", "1.3.1", False),
+        fill(2, "1.3.1", "1.3.0", False, "1.3.1"),
+        # the maker side of the first fill
+        fill(3, "1.3.1", "1.3.0", True),
+        # another market, with a fee in the market's other asset
+        fill(4, "1.3.0", "1.3.5", False, "1.3.1"),
+        fill(5, "1.3.2", "1.3.5", False),
+        # an order of the market that is not a fill
+        {
+            "operation_type": 1,
+            "account_history.operation_id": "1.11.6",
+            "operation_history.op_object.amount_to_sell.asset_id": "1.3.0",
+            "operation_history.op_object.min_to_receive.asset_id": "1.3.1",
+            "operation_history.op_object.fill_or_kill": False,
+        },
+        swap(7, pool, "1.3.0", "1.3.1"),
+        swap(8, "1.19.7", "1.3.0", "1.3.1"),
+        swap(9, "1.19.50", "1.3.0", "1.3.1"),
+    ]
+    assets = set(market.split(":"))
+    legacy = {
+        "fills": stand_in_search(legacy_query("fills", market), docs),
+        "swaps": stand_in_search(legacy_query("swaps", pool), docs),
+    }
+    keyword = {
+        "fills": stand_in_search(kibana_fills(market, 0, 0), docs),
+        "swaps": stand_in_search(kibana_swaps(pool, 0, 0), docs),
+    }
+    # parse_price_history() priced only the fills paying and receiving the market's
+    # assets, the fills of other markets sharing an asset were dropped
+    kept = [
+        i
+        for i in legacy["fills"]
+        if {
+            i["operation_history.op_object.pays.asset_id"],
+            i["operation_history.op_object.receives.asset_id"],
+        }
+        == assets
+    ]
+    assert len(legacy["fills"]) > len(kept)
+    assert keyword["fills"] == kept, keyword["fills"]
+    assert keyword["swaps"] == legacy["swaps"], keyword["swaps"]
+    print("keyword terms return the market's hits of the full text filters")
+
+
+if __name__ == "__main__":
+    unit_test()
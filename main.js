@@ -564,21 +564,22 @@ function handleOrderbookMessage(event) {
     } catch (e) {
         console.log(e);
     };
-    booktimeout = setTimeout(book, 10000);
+    // the server pushes book updates as the market changes, this is only a fallback
+    booktimeout = setTimeout(book, 60000);
 };
 function handleBlocknumMessage(event) {
     /*
     *
     */
+    // the server pushes every new block, no need to ask again
     document.getElementById("blocknum").innerHTML = event;
-    setTimeout(function() {socketResource.send(JSON.stringify({"resource":"blocknum"}));}, 1000)
 };
 function handleTickerMessage(event) {
     /*
     *
     */
+    // the server pushes the ticker along with the book as the market changes
     document.getElementById("ticker").innerHTML = JSON.stringify(event);
-    setTimeout(sendTickerReq, 10000);
 };
 function handleMarketPairsMessage(event) {
     /*
@@ -0,0 +1,234 @@
+# pylint: disable=broad-except
+"""
+ ╔╗ ┬┌┬┐┌─┐┬ ┬┌─┐┬─┐┌─┐┌─┐  ╔╦╗┌─┐─┐ ┬  ╦ ╦─┐ ┬
+ ╠╩╗│ │ └─┐├─┤├─┤├┬┘├┤ └─┐   ║║├┤ ┌┴┬┘  ║ ║┌┴┬┘
+ ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
+Bitshares Decentralized Exchange User Experience
+
+Push block numbers and market updates to clients as the node reports them
+"""
+# STANDARD MOUDLES
+import asyncio
+import contextlib
+import itertools
+import time
+
+# BITSHARES DEX UX MODULES
+from config import BLOCK_SECONDS, FEED_REFRESH_BLOCKS, FEED_STALL
+from rpc import (
+    RPC_CACHE,
+    rpc_get_objects,
+    rpc_set_subscribe_callback,
+    rpc_subscribe_to_market,
+    rpc_unsubscribe_from_market,
+    wss_handshake,
+)
+from utilities import it
+
+
+class MarketFeed:
+    """
+    one subscribed node connection shared by every client
+    set_subscribe_callback on the dynamic global properties gives each new block
+    subscribe_to_market marks a market changed when its orders change
+    once per block each changed market is recomputed a single time
+    and pushed to every client watching it, however many there are
+    """
+
+    def __init__(self):
+        self.rpc = None
+        self.callbacks = itertools.count(1)
+        # market key ->
+        # {"pair", "refresh", "token", "last", "dirty", "watchers", "callback"}
+        self.markets = {}
+        # client websocket -> the market key it watches
+        self.clients = {}
+        # client websockets watching the block number
+        self.blocks = set()
+        self.block = None
+        # monotonic time of the last dynamic global properties notice
+        self.noticed = 0
+        # on_block tasks still running, referenced so they are not collected
+        self.tasks = set()
+        # markets recomputed, and messages pushed to clients
+        self.recomputes = 0
+        self.pushes = 0
+
+    async def watch(self, ws, key, pair, refresh, token=None):
+        """
+        push the market to ws until it watches another market or disconnects
+        refresh() is awaited for the list of messages to push
+        pair is subscribed to on the node unless token is given, then the market is
+        recomputed whenever token() returns a different object, ie. a pools row
+        """
+        if self.clients.get(ws) == key:
+            return
+        await self.unwatch(ws)
+        self.clients[ws] = key
+        if key not in self.markets:
+            self.markets[key] = {
+                "pair": None if token else pair,
+                "refresh": refresh,
+                "token": token,
+                "last": token() if token else None,
+                "dirty": False,
+                "watchers": set(),
+                "callback": None,
+            }
+            await self.subscribe(key)
+        self.markets[key]["watchers"].add(ws)
+
+    async def unwatch(self, ws):
+        """
+        stop pushing a market to ws, unsubscribing once nobody watches it
+        """
+        key = self.clients.pop(ws, None)
+        market = self.markets.get(key)
+        if market is None:
+            return
+        market["watchers"].discard(ws)
+        if not market["watchers"]:
+            del self.markets[key]
+            if market["pair"] and self.rpc is not None:
+                self.rpc.notices.pop(market["callback"], None)
+                with contextlib.suppress(Exception):
+                    await rpc_unsubscribe_from_market(self.rpc, market["pair"])
+
+    def watch_blocks(self, ws):
+        """
+        push every new block number to ws
+        """
+        self.blocks.add(ws)
+
+    async def forget(self, ws):
+        """
+        stop every push to a disconnected client
+        """
+        self.blocks.discard(ws)
+        await self.unwatch(ws)
+
+    async def subscribe(self, key):
+        """
+        ask the node for notices about a market
+        """
+        market = self.markets[key]
+        if market["pair"] and self.rpc is not None:
+            callback = next(self.callbacks)
+            market["callback"] = callback
+            self.rpc.notices[callback] = lambda _, key=key: self.changed(key)
+            await rpc_subscribe_to_market(self.rpc, callback, market["pair"])
+
+    def changed(self, key):
+        """
+        a notice that a market changed, it is recomputed on the next block
+        """
+        if key in self.markets:
+            self.markets[key]["dirty"] = True
+
+    def on_objects(self, notice):
+        """
+        find the head block number in an object notice
+        """
+        for objects in notice:
+            for obj in objects if isinstance(objects, list) else [objects]:
+                if isinstance(obj, dict) and obj.get("id") == "2.1.0":
+                    self.noticed = time.monotonic()
+                    block = obj["head_block_number"]
+                    if block != self.block:
+                        self.block = block
+                        RPC_CACHE.advance(block)
+                        task = asyncio.create_task(self.on_block(block))
+                        self.tasks.add(task)
+                        task.add_done_callback(self.tasks.discard)
+
+    async def on_block(self, block):
+        """
+        push the block number, then every market which changed
+        every FEED_REFRESH_BLOCKS blocks all markets are recomputed regardless
+        so that 24h tickers keep rolling through quiet markets
+        """
+        await self.push(self.blocks, [{"resource": "blocknum", "payload": block}])
+        for market in self.markets.values():
+            if market["token"] is not None:
+                token = market["token"]()
+                if token is not market["last"]:
+                    market["last"] = token
+                    market["dirty"] = True
+            if block % FEED_REFRESH_BLOCKS == 0:
+                market["dirty"] = True
+        dirty = [i for i in self.markets.values() if i["dirty"]]
+        for market in dirty:
+            market["dirty"] = False
+        await asyncio.gather(*[self.recompute(i) for i in dirty])
+
+    async def recompute(self, market):
+        """
+        refresh a market once and push it to all its watchers
+        """
+        try:
+            messages = await market["refresh"]()
+        except Exception as error:
+            print(it("orange", f"[FEED] refresh failed with error '{error}'"))
+            market["dirty"] = True
+            return
+        self.recomputes += 1
+        await self.push(set(market["watchers"]), messages)
+
+    async def push(self, clients, messages):
+        """
+        send messages to clients, forgetting those which have gone away
+        """
+        for ws in list(clients):
+            try:
+                for message in messages:
+                    await ws.send_media(message)
+                    self.pushes += 1
+            except Exception:
+                await self.forget(ws)
+
+    async def watchdog(self):
+        """
+        wait on the subscribed connection until it closes
+        raise TimeoutError when no block notice arrived for FEED_STALL seconds,
+        ie. a node which stopped pushing, so that run() resubscribes elsewhere
+        """
+        while not self.rpc.reader.done():
+            await asyncio.wait({self.rpc.reader}, timeout=BLOCK_SECONDS)
+            if time.monotonic() - self.noticed > FEED_STALL:
+                raise TimeoutError(f"no block notice for {FEED_STALL} seconds")
+        await self.rpc.reader
+
+    async def run(self):
+        """
+        keep a subscribed node connection, resubscribing after every reconnect
+        or whenever block notices stop arriving
+        """
+        while True:
+            try:
+                self.rpc = await wss_handshake()
+                self.noticed = time.monotonic()
+                callback = next(self.callbacks)
+                self.rpc.notices[callback] = self.on_objects
+                await rpc_set_subscribe_callback(self.rpc, callback)
+                # fetching the dynamic global properties subscribes to them
+                await rpc_get_objects(self.rpc, ["2.1.0"])
+                for key, market in self.markets.items():
+                    market["dirty"] = True
+                    await self.subscribe(key)
+                print(it("cyan", f"[FEED] subscribed on {self.rpc.node}"))
+                await self.watchdog()
+            except asyncio.CancelledError:
+                for task in self.tasks:
+                    task.cancel()
+                if self.rpc is not None:
+                    await self.rpc.close()
+                raise
+            except Exception as error:
+                print(it("orange", f"[FEED] subscription failed with error '{error}'"))
+            if self.rpc is not None:
+                await self.rpc.close()
+            self.rpc = None
+            await asyncio.sleep(1)
+
+
+MARKET_FEED = MarketFeed()
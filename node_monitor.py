@@ -0,0 +1,101 @@
+# pylint: disable=broad-except
+"""
+ ╔╗ ┬┌┬┐┌─┐┬ ┬┌─┐┬─┐┌─┐┌─┐  ╔╦╗┌─┐─┐ ┬  ╦ ╦─┐ ┬
+ ╠╩╗│ │ └─┐├─┤├─┤├┬┘├┤ └─┐   ║║├┤ ┌┴┬┘  ║ ║┌┴┬┘
+ ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
+Bitshares Decentralized Exchange User Experience
+
+Measure the health of every node into the nodes table
+"""
+# STANDARD MOUDLES
+import asyncio
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+
+# BITSHARES DEX UX MODULES
+from config import NODE_MAX_LAG, NODE_PROBE_SECONDS, NODE_TIMEOUT
+from database import AsyncSql, Sql
+from rpc import NODES, RPC_CACHE, RPC_HUB, SINGLEFLIGHT, RpcConnection
+from utilities import it
+
+# nodes.code of each nodes.status
+CODES = {"OK": 200, "LAGGING": 503, "DOWN": 502}
+
+
+async def probe(session, node):
+    """
+    connect to a node and ask it for its head block
+    :return (seconds to connect, seconds to answer, head block unix time):
+    """
+    start = time.perf_counter()
+    ws = await asyncio.wait_for(session.ws_connect(node), NODE_TIMEOUT)
+    handshake = time.perf_counter() - start
+    rpc = RpcConnection(node, ws)
+    try:
+        start = time.perf_counter()
+        ret = await rpc.query(["database", "get_objects", [["2.1.0"]]], NODE_TIMEOUT)
+        ping = time.perf_counter() - start
+    finally:
+        await rpc.close()
+    blocktime = datetime.strptime(ret["result"][0]["time"], "%Y-%m-%dT%H:%M:%S")
+    return handshake, ping, int(blocktime.replace(tzinfo=timezone.utc).timestamp())
+
+
+async def check_nodes(sql, nodes=None):
+    """
+    probe every node at once and write their health to the nodes table
+    a node is LAGGING when its head block trails the freshest node's by more than
+    NODE_MAX_LAG seconds, and DOWN when it fails to connect or answer in time
+    :return {url: status}:
+    """
+    nodes = nodes or NODES
+    async with aiohttp.ClientSession() as session:
+        probes = await asyncio.gather(
+            *[probe(session, node) for node in nodes], return_exceptions=True
+        )
+    freshest = max(
+        (i[2] for i in probes if not isinstance(i, BaseException)), default=0
+    )
+    rows = []
+    for node, result in zip(nodes, probes):
+        if isinstance(result, BaseException):
+            status = "DOWN"
+            handshake, ping, blocktime = None, None, None
+        else:
+            handshake, ping, blocktime = result
+            status = "LAGGING" if freshest - blocktime > NODE_MAX_LAG else "OK"
+        rows.append((node, ping, handshake, blocktime, CODES[status], status))
+    await sql.run(
+        Sql.executemany,
+        "INSERT OR REPLACE INTO nodes VALUES (?,?,?,?,?,?)",
+        rows,
+        write=True,
+    )
+    return {i[0]: i[-1] for i in rows}
+
+
+async def node_monitor():
+    """
+    check the nodes every NODE_PROBE_SECONDS, forever
+    hub connections to nodes which fell behind or went down are replaced
+    as long as at least one node is in sync
+    """
+    sql = AsyncSql()
+    while True:
+        try:
+            health = await check_nodes(sql)
+            print(it("cyan", f"[NODES] {health}"))
+            print(it("cyan", f"[RPC] singleflight {SINGLEFLIGHT.stats()}"))
+            print(it("cyan", f"[RPC] cache {RPC_CACHE.stats()}"))
+            print(it("cyan", f"[RPC] hub {RPC_HUB.stats()}"))
+            if "OK" in health.values():
+                await RPC_HUB.retire({k for k, v in health.items() if v != "OK"})
+        except Exception as error:
+            print(it("orange", f"[NODES] health check failed with error '{error}'"))
+        await asyncio.sleep(NODE_PROBE_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(node_monitor())
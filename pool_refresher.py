@@ -0,0 +1,129 @@
+# pylint: disable=broad-except
+"""
+ ╔╗ ┬┌┬┐┌─┐┬ ┬┌─┐┬─┐┌─┐┌─┐  ╔╦╗┌─┐─┐ ┬  ╦ ╦─┐ ┬
+ ╠╩╗│ │ └─┐├─┤├─┤├┬┘├┤ └─┐   ║║├┤ ┌┴┬┘  ║ ║┌┴┬┘
+ ╚═╝┴ ┴ └─┘┴ ┴┴ ┴┴└─└─┘└─┘  ═╩╝└─┘┴ └─  ╚═╝┴ └─
+Bitshares Decentralized Exchange User Experience
+
+Keep the balances and 24h volumes in the pools table a few blocks fresh
+"""
+# STANDARD MOUDLES
+import asyncio
+from math import ceil
+
+# BITSHARES DEX UX MODULES
+from config import BLOCK_SECONDS, POOL_REFRESH_BLOCKS
+from database import AsyncSql, Sql
+from rpc import RPC_CACHE, RPC_HUB, rpc_get_liquidity_pools, rpc_get_objects
+from sql_utils import METADATA
+from utilities import chunks, it
+
+# pools per get_liquidity_pools call
+BATCH = 100
+# the columns refreshed, in the order of UPDATE_POOL's placeholders
+REFRESHED = ["balance_a", "balance_b", "virtual_value", "volume_a", "volume_b"]
+UPDATE_POOL = (
+    "UPDATE pools SET balance_a=?, balance_b=?, virtual_value=?, volume_a=?, volume_b=?"
+    " WHERE id=?"
+)
+
+
+def pool_balances(liquidity_pool, prec_a, prec_b):
+    """
+    the REFRESHED columns of a pools row from a get_liquidity_pools object
+    """
+    stats = liquidity_pool.get("statistics", {})
+    return {
+        "balance_a": float(int(liquidity_pool["balance_a"]) / 10**prec_a),
+        "balance_b": float(int(liquidity_pool["balance_b"]) / 10**prec_b),
+        "virtual_value": int(liquidity_pool["virtual_value"])
+        / 10 ** (prec_a + prec_b),
+        "volume_a": (
+            int(stats.get("_24h_exchange_a2b_amount_a", 0))
+            + int(stats.get("_24h_exchange_b2a_amount_a", 0))
+        )
+        / 10**prec_a,
+        "volume_b": (
+            int(stats.get("_24h_exchange_a2b_amount_b", 0))
+            + int(stats.get("_24h_exchange_b2a_amount_b", 0))
+        )
+        / 10**prec_b,
+    }
+
+
+def changed_pools(sql, liquidity_pools):
+    """
+    the cached pools rows, updated, whose REFRESHED columns differ from the chain
+    """
+    changed = []
+    for pool_id, liquidity_pool in liquidity_pools.items():
+        pool = METADATA.pool(sql, pool_id)
+        balances = pool_balances(
+            liquidity_pool,
+            METADATA.asset(sql, pool["asset_a"])["precision"],
+            METADATA.asset(sql, pool["asset_b"])["precision"],
+        )
+        if any(pool.get(k) != v for k, v in balances.items()):
+            changed.append({**pool, **balances})
+    return changed
+
+
+async def refresh_pools(rpc, sql):
+    """
+    bulk fetch every known pool and write only the rows which changed
+    :return int(pools changed):
+    """
+    await sql.run(METADATA.refresh)
+    pool_ids = list(METADATA.pools)
+    liquidity_pools = {}
+    for fetched in await asyncio.gather(
+        *[
+            rpc_get_liquidity_pools(rpc, chunk)
+            for chunk in chunks(pool_ids, ceil(len(pool_ids) / BATCH))
+        ]
+    ):
+        liquidity_pools.update(fetched)
+    changed = await sql.run(changed_pools, liquidity_pools)
+    if changed:
+        await sql.run(
+            Sql.executemany,
+            UPDATE_POOL,
+            [tuple(i[k] for k in REFRESHED) + (i["id"],) for i in changed],
+            write=True,
+        )
+        METADATA.update_pools(changed)
+    return len(changed)
+
+
+async def head_block(rpc):
+    """
+    the current head block number, which also expires the RPC_CACHE
+    """
+    block = (await rpc_get_objects(rpc, ["2.1.0"]))["2.1.0"]["head_block_number"]
+    RPC_CACHE.advance(block)
+    return block
+
+
+async def pool_refresher():
+    """
+    refresh the pools every POOL_REFRESH_BLOCKS blocks, forever
+    the RPC_HUB fails over to another node whenever the current one fails
+    """
+    sql = AsyncSql()
+    rpc = RPC_HUB.client()
+    refreshed = 0
+    while True:
+        try:
+            block = await head_block(rpc)
+            if block - refreshed >= POOL_REFRESH_BLOCKS:
+                changed = await refresh_pools(rpc, sql)
+                refreshed = block
+                if changed:
+                    print(it("cyan", f"[POOLS] {changed} pools changed at {block}"))
+        except Exception as error:
+            print(it("orange", f"[POOLS] refresh failed with error '{error}'"))
+        await asyncio.sleep(BLOCK_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(pool_refresher())
@@ -8,18 +8,37 @@ Bitshares Decentralized Exchange User Experience
 
 # STANDARD MOUDLES
 import asyncio
+import json
 import random
 import time
-from math import ceil
+from collections import OrderedDict, deque
 
 import aiohttp
 
 import contextlib
 
 # BITSHARES DEX UX MODULES
-from sql_utils import precision
-from utilities import chunks, it, to_iso_date, get_nonce
-from config import RPC_USE_INTERNAL_HANDLER
+from database import AsyncSql
+from sql_utils import precision, read_account_names, write_account_names
+from utilities import it, to_iso_date, get_nonce
+from config import (
+    ACCOUNT_BATCH,
+    ACCOUNT_CACHE_SIZE,
+    HUB_CLIENT_INFLIGHT,
+    HUB_CONNECTIONS,
+    HUB_HEARTBEAT,
+    HUB_HEDGE,
+    HEDGE_DELAY,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_PERCENTILE,
+    LATENCY_SAMPLES,
+    NODE_TIMEOUT,
+    RPC_CACHE_SIZE,
+    RPC_CACHE_TTL,
+    RPC_TIMEOUT,
+    RPC_USE_INTERNAL_HANDLER,
+    TICKER_CONCURRENCY,
+)
 
 NODES = [
     "wss://api.bts.mobi/wss",
@@ -54,63 +73,560 @@ NODES = [
 async def wss_handshake():
     """
     Create a websocket handshake
+    :return RpcConnection: a connection of its own, with its own session
+    """
+    return RpcConnection(*await handshake())
+
+
+async def ranked_nodes():
+    """
+    NODES fastest first by the last health check in the nodes table
+    nodes which are lagging or down go last, unchecked nodes before them
+    """
+    health = {}
+    try:
+        rows = await AsyncSql().execute("SELECT url, ping, status FROM nodes", raw=True)
+        health = {
+            url: (status in ("LAGGING", "DOWN"), 999.9 if ping is None else ping)
+            for url, ping, status in rows
+        }
+    except Exception as error:
+        print(it("orange", f"node health unavailable: {error}"))
+    # shuffled first so that nodes which tie keep a random order
+    nodes = random.sample(NODES, len(NODES))
+    return sorted(nodes, key=lambda node: health.get(node) or (False, 999.9))
+
+
+async def handshake():
+    """
+    connect to the fastest in sync node which accepts, trying again until one does
+    :return (node, websocket, session):
     """
-    with contextlib.suppress(AttributeError):
-        await wss_handshake.session.close()
     while True:
-        try:
-            node = random.choice(NODES)
-            start = time.time()
-            print("await websocket connect", node)
-            # rpc = await websockets.connect(node, open_timeout=10)
-            wss_handshake.session = aiohttp.ClientSession()
-            rpc = await wss_handshake.session.ws_connect("wss://api.bts.mobi/wss")
-            # rpc = wss(node, timeout=3)
-            if time.time() - start < 100:
+        for node in await ranked_nodes():
+            session = aiohttp.ClientSession()
+            try:
+                print("await websocket connect", node)
+                # a half open connection misses a pong and closes, so it is replaced
+                ws = await asyncio.wait_for(
+                    session.ws_connect(node, heartbeat=HUB_HEARTBEAT), NODE_TIMEOUT
+                )
                 print("connected, MOON!")
-                break
-            else:
-                print(it("orange", "websocket connection timed out"))
-        except Exception as error:
-            print(
-                it(
-                    "orange",
-                    "Websocket handshake failed with error '"
-                    + str(error)
-                    + "'. Trying again...",
+                return node, ws, session
+            except Exception as error:
+                await session.close()
+                print(
+                    it(
+                        "orange",
+                        "Websocket handshake failed with error '"
+                        + str(error)
+                        + "'. Trying again...",
+                    )
                 )
+        await asyncio.sleep(1)
+
+
+class RpcConnection:
+    """
+    one websocket to a node shared by any number of concurrent requests
+    a single reader task hands each response to the future awaiting its id
+    requests which time out are forgotten, their late responses are dropped
+    subscription notices go to the function registered for their callback id
+    """
+
+    def __init__(self, node, ws, session=None):
+        self.node = node
+        self.ws = ws
+        # closed with the connection when the connection owns it
+        self.session = session
+        # request id -> future of its response
+        self.pending = {}
+        # responses which arrived after their request timed out or was cancelled
+        self.orphans = 0
+        # subscription callback id -> function called with each notice's data
+        self.notices = {}
+        # requests the hub has routed here which are not answered yet
+        self.inflight = 0
+        self.reader = asyncio.create_task(self.read())
+
+    @property
+    def closed(self):
+        """
+        True once the websocket is closed
+        """
+        return self.ws.closed
+
+    @property
+    def alive(self):
+        """
+        True until the websocket closes or its reader stops
+        """
+        return not self.ws.closed and not self.reader.done()
+
+    async def read(self):
+        """
+        resolve pending requests as their responses arrive, in any order
+        """
+        ws = self.ws
+        try:
+            async for msg in ws:
+                resp = msg.json()
+                if resp.get("method") == "notice":
+                    callback = self.notices.get(resp["params"][0])
+                    if callback is not None:
+                        callback(resp["params"][1])
+                    continue
+                future = self.pending.pop(resp.get("id"), None)
+                if future is not None and not future.done():
+                    future.set_result(resp)
+                elif "id" in resp:
+                    self.orphans += 1
+        finally:
+            # unless reconnect() has already replaced this websocket
+            if ws is self.ws:
+                self.fail(ConnectionError(f"{self.node} closed the connection"))
+
+    def fail(self, error):
+        """
+        raise error in every request still waiting on this connection
+        """
+        for future in self.pending.values():
+            if not future.done():
+                future.set_exception(error)
+        self.pending.clear()
+
+    async def query(self, params, timeout=RPC_TIMEOUT):
+        """
+        send one request and await its response for at most timeout seconds
+        """
+        if not self.alive:
+            raise ConnectionError(f"{self.node} connection is closed")
+        nonce = get_nonce()
+        future = asyncio.get_running_loop().create_future()
+        self.pending[nonce] = future
+        try:
+            await self.ws.send_json(
+                {"method": "call", "params": params, "jsonrpc": "2.0", "id": nonce}
             )
-    return rpc
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            # a timed out or cancelled request leaves nothing behind
+            self.pending.pop(nonce, None)
+
+    async def reconnect(self):
+        """
+        replace the websocket of a connection of its own with a new handshake
+        """
+        await self.close()
+        self.node, self.ws, self.session = await handshake()
+        self.reader = asyncio.create_task(self.read())
+
+    async def close(self):
+        """
+        close the websocket, failing anything still pending
+        """
+        self.reader.cancel()
+        with contextlib.suppress(Exception):
+            await self.ws.close()
+        if self.session is not None:
+            await self.session.close()
+        self.fail(ConnectionError(f"{self.node} connection closed"))
+
+
+class HubClient:
+    """
+    a websocket client's handle on the hub, a few bytes instead of a connection
+    at most HUB_CLIENT_INFLIGHT of its requests are in flight at once
+    so that no one client can crowd out the others on the shared connections
+    """
+
+    def __init__(self, hub, inflight=HUB_CLIENT_INFLIGHT):
+        self.hub = hub
+        self.slots = asyncio.Semaphore(inflight)
+
+    async def query(self, params):
+        """
+        send one request through the hub and await its response
+        """
+        async with self.slots:
+            return await self.hub.query(params)
+
+    async def close(self):
+        """
+        the shared connections stay open for every other client
+        """
+
+
+class RpcHub:
+    """
+    process wide pool of HUB_CONNECTIONS upstream node connections
+    requests from every client are multiplexed over them by JSON-RPC id
+    each request goes to the least busy connection; a connection which fails
+    is replaced by one to another node and its requests are tried again
+    with HUB_HEDGE, a hedgeable() read still unanswered after its node's
+    HEDGE_PERCENTILE latency is also sent to another node, the first answer wins
+    """
+
+    def __init__(self, size=HUB_CONNECTIONS):
+        self.size = size
+        self.session = None
+        self.upstreams = []
+        # created lazily so that it binds to the running event loop
+        self.lock = None
+        # node -> latest response times in seconds
+        self.latencies = {}
+        # requests sent, hedges sent, and hedges which answered first
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def client(self, inflight=HUB_CLIENT_INFLIGHT):
+        """
+        a new handle on the hub for one websocket client
+        """
+        return HubClient(self, inflight)
+
+    async def connect(self, avoid=()):
+        """
+        open a connection to the fastest in sync node, other than those to avoid
+        if possible
+        """
+        nodes = await ranked_nodes()
+        nodes.sort(key=lambda node: node in avoid)
+        for node in nodes:
+            try:
+                ws = await asyncio.wait_for(
+                    self.session.ws_connect(node, heartbeat=HUB_HEARTBEAT),
+                    NODE_TIMEOUT,
+                )
+                print(it("green", f"[HUB] connected to {node}"))
+                return RpcConnection(node, ws)
+            except Exception as error:
+                print(it("orange", f"[HUB] connecting to {node} failed: {error}"))
+        raise ConnectionError("no node accepted a connection")
+
+    async def upstream(self):
+        """
+        the live connection with the fewest requests in flight
+        dead connections are replaced first
+        """
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            if self.session is None:
+                self.session = aiohttp.ClientSession()
+            for upstream in [i for i in self.upstreams if not i.alive]:
+                self.upstreams.remove(upstream)
+                await upstream.close()
+            avoid = {i.node for i in self.upstreams}
+            while len(self.upstreams) < self.size:
+                upstream = await self.connect(avoid)
+                avoid.add(upstream.node)
+                self.upstreams.append(upstream)
+        return min(self.upstreams, key=lambda i: i.inflight)
+
+    async def timed(self, upstream, params):
+        """
+        send one request on upstream and record how long its node took to answer
+        a request cancelled unanswered, ie. a hedge loser, records how long it
+        waited, a censored sample; leaving it out would bias the percentiles low
+        """
+        start = time.monotonic()
+        try:
+            ret = await upstream.query(params)
+        except asyncio.CancelledError:
+            self.record(upstream.node, time.monotonic() - start)
+            raise
+        finally:
+            upstream.inflight -= 1
+        self.record(upstream.node, time.monotonic() - start)
+        return ret
+
+    def record(self, node, seconds):
+        """
+        keep the latest LATENCY_SAMPLES response times of node
+        """
+        self.latencies.setdefault(node, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def route(self, upstream, params):
+        """
+        count a request against upstream before it is sent, then send it
+        """
+        upstream.inflight += 1
+        return asyncio.ensure_future(self.timed(upstream, params))
+
+    def threshold(self, node):
+        """
+        seconds to wait on node before hedging, HEDGE_DELAY until it has history
+        """
+        samples = self.latencies.get(node, ())
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DELAY
+        return percentile(samples, HEDGE_PERCENTILE)
+
+    async def hedged(self, primary, params):
+        """
+        send a read on primary and, if it is slow, on another node as well
+        whichever answers first wins and the other request is cancelled
+        """
+        first = self.route(primary, params)
+        tasks = {first}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.threshold(primary.node))
+            others = [i for i in self.upstreams if i.alive and i.node != primary.node]
+            if done or not others:
+                return await first
+            self.hedges += 1
+            hedge = self.route(min(others, key=lambda i: i.inflight), params)
+            tasks.add(hedge)
+            while tasks:
+                done, tasks = await asyncio.wait(
+                    tasks, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self.hedge_wins += task is hedge
+                        return task.result()
+            # both failed, fail over as the primary would have alone
+            return await first
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def query(self, params):
+        """
+        send one request on the least busy connection, failing over once
+        """
+        for attempt in range(2):
+            upstream = await self.upstream()
+            self.requests += 1
+            try:
+                if HUB_HEDGE and hedgeable(params):
+                    return await self.hedged(upstream, params)
+                return await self.route(upstream, params)
+            except (ConnectionError, aiohttp.ClientError) as error:
+                print(it("orange", f"[HUB] {upstream.node} failed: {error}"))
+                await upstream.close()
+                if attempt:
+                    raise
+        return {}
+
+    def stats(self):
+        """
+        p50 and p99 response time per node, in milliseconds, and the hedge rate
+        """
+        return {
+            "nodes": {
+                node: {
+                    "p50": round(percentile(samples, 50) * 1000, 1),
+                    "p99": round(percentile(samples, 99) * 1000, 1),
+                    "samples": len(samples),
+                }
+                for node, samples in self.latencies.items()
+                if samples
+            },
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_rate": round(self.hedges / max(self.requests, 1), 3),
+        }
+
+    async def retire(self, nodes):
+        """
+        close the connections to nodes, the next query replaces them
+        """
+        for upstream in [i for i in self.upstreams if i.node in nodes]:
+            print(it("purple", f"[HUB] retiring {upstream.node}"))
+            await upstream.close()
+
+    async def close(self):
+        """
+        close every upstream connection
+        """
+        for upstream in self.upstreams:
+            await upstream.close()
+        self.upstreams = []
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+
+RPC_HUB = RpcHub()
+# latency sensitive reads which may be hedged: book and ticker
+HEDGED = ("get_order_book", "get_ticker")
+# and of the get_objects reads, only the head block poll
+HEAD_BLOCK = [["2.1.0"]]
+
+
+def hedgeable(params):
+    """
+    whether a request is latency sensitive enough to send to a second node
+    """
+    return params[1] in HEDGED or (
+        params[1] == "get_objects" and params[2] == HEAD_BLOCK
+    )
+
+
+def percentile(samples, pct):
+    """
+    the pct percentile of samples, nearest rank
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class SingleFlight:
+    """
+    concurrent identical read queries share a single upstream request
+    every caller gets the same result object, so treat results as read only
+    """
+
+    def __init__(self):
+        # query key -> future of the request in flight
+        self.flights = {}
+        # queries asked for, and requests actually sent upstream
+        self.calls = 0
+        self.requests = 0
+
+    async def do(self, key, request):
+        """
+        await request() unless an identical one is already in flight
+        """
+        self.calls += 1
+        flight = self.flights.get(key)
+        if flight is None:
+            self.requests += 1
+            flight = asyncio.ensure_future(request())
+            self.flights[key] = flight
+            flight.add_done_callback(lambda _: self.flights.pop(key, None))
+        # a cancelled caller must not cancel the request shared by the others
+        return await asyncio.shield(flight)
+
+    def stats(self):
+        """
+        calls, upstream requests and the collapse ratio of calls per request
+        """
+        return {
+            "calls": self.calls,
+            "requests": self.requests,
+            "collapsed": self.calls - self.requests,
+            "ratio": round(self.calls / max(self.requests, 1), 2),
+        }
+
+
+class BlockCache:
+    """
+    bounded LRU cache of read results which expire with the block they were read in
+    an entry is fresh until a newer head block is seen via advance()
+    and for at most ttl seconds, so it also expires when no blocks are reported
+    """
+
+    def __init__(self, size=RPC_CACHE_SIZE, ttl=RPC_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self.block = 0
+        # query key -> (head block, monotonic time, result)
+        self.entries = OrderedDict()
+        # fresh hits, cold misses, entries found stale, and LRU evictions
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    def advance(self, block):
+        """
+        a new head block, every entry read before it is now stale
+        """
+        self.block = max(self.block, block)
+
+    def get(self, key):
+        """
+        the fresh result of a query, or None
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        block, stored, result = entry
+        if block < self.block or time.monotonic() - stored > self.ttl:
+            self.stale += 1
+            del self.entries[key]
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result, block):
+        """
+        remember a result read at block, the head block when its request was sent
+        a result read before a block which has since been seen is never stored
+        """
+        if block < self.block:
+            self.stale += 1
+            return
+        self.entries[key] = (block, time.monotonic(), result)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        """
+        hits, misses, stale entries, evictions and the hit ratio
+        """
+        lookups = self.hits + self.misses + self.stale
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "hit_ratio": round(self.hits / max(lookups, 1), 3),
+        }
+
+
+SINGLEFLIGHT = SingleFlight()
+RPC_CACHE = BlockCache()
+# database api methods without side effects, which are safe to collapse
+COALESCED = ("get_", "list_", "lookup_")
+# database api methods whose results can only change from one block to the next
+CACHED = ("get_ticker", "get_order_book", "get_objects")
 
 
 async def wss_query(rpc, params):
     """
     Send and receive websocket requests
+    identical concurrent reads by any hub client share one request via SINGLEFLIGHT
+    ticker, book and object reads by hub clients are cached for the block in RPC_CACHE
+    a connection of its own is never shared, its reads may subscribe it to objects
+    """
+    if not isinstance(rpc, HubClient) or not params[1].startswith(COALESCED):
+        return await wss_request(rpc, params)
+    key = (id(rpc.hub), json.dumps(params))
+    if params[1] in CACHED:
+        ret = RPC_CACHE.get(key)
+        if ret is None:
+            # the block as of sending, the node may answer after a newer one
+            block = RPC_CACHE.block
+            ret = await SINGLEFLIGHT.do(key, lambda: wss_request(rpc, params))
+            # an error response is returned whole, never remember one
+            if not (isinstance(ret, dict) and "error" in ret):
+                RPC_CACHE.put(key, ret, block)
+        return ret
+    return await SINGLEFLIGHT.do(key, lambda: wss_request(rpc, params))
+
+
+async def wss_request(rpc, params):
+    """
+    Send one request and receive its response
+    rpc is either an RpcConnection of its own or a client of the RPC_HUB
+    concurrent queries share the websocket and complete in one round trip
     """
-    nonce = get_nonce()
-    try:
-        wss_query.nonce_dict
-    except AttributeError:
-        wss_query.nonce_dict = {}
-
-    query = {"method": "call", "params": params, "jsonrpc": "2.0", "id": nonce}
     i = 0
     ret = {}
     while True:
         try:
-            try:
-                await rpc.send_json(query)
-                async for msg in rpc:
-                    resp = msg.json()
-                    wss_query.nonce_dict[int(resp["id"])] = resp
-                    if nonce in wss_query.nonce_dict:
-                        ret = wss_query.nonce_dict.pop(nonce)
-                        break
-            except Exception as error:
-                if "Concurrent call to receive() is not allowed" not in str(error):
-                    raise
-                await asyncio.sleep(0.01)
-                continue
+            ret = await rpc.query(params)
             break
         except Exception as error:
             print(
@@ -120,15 +636,14 @@ async def wss_query(rpc, params):
                 raise
             await asyncio.sleep((i / 2) ** 2)
             i += 1
-            if i % 3 == 0:
+            if i % 3 == 0 and isinstance(rpc, RpcConnection):
                 print(
                     it(
                         "purple",
                         "Websocket query failed 3 times in a row, re-connecting...",
                     )
                 )
-                await rpc.close()
-                rpc = await wss_handshake()
+                await rpc.reconnect()
             if i % 15 == 0:
                 print(
                     it(
@@ -146,20 +661,75 @@ async def wss_query(rpc, params):
     return ret
 
 
+class AccountNames:
+    """
+    account id -> name from an in memory LRU, then the accounts table, then the node
+    account names never change, so each one is fetched from the node at most once
+    """
+
+    def __init__(self, size=ACCOUNT_CACHE_SIZE):
+        self.size = size
+        self.names = OrderedDict()
+
+    def remember(self, names):
+        """
+        add names to the LRU, evicting the least recently used beyond size
+        """
+        for account_id, name in names.items():
+            self.names[account_id] = name
+            self.names.move_to_end(account_id)
+        while len(self.names) > self.size:
+            self.names.popitem(last=False)
+
+    async def lookup(self, rpc, account_ids):
+        """
+        the names of account ids, those which do not exist are left out
+        """
+        lookup, missing = {}, []
+        for account_id in dict.fromkeys(account_ids):
+            if account_id in self.names:
+                self.names.move_to_end(account_id)
+                lookup[account_id] = self.names[account_id]
+            else:
+                missing.append(account_id)
+        if not missing:
+            return lookup
+        sql = AsyncSql()
+        stored = await sql.run(read_account_names, missing)
+        lookup.update(stored)
+        self.remember(stored)
+        missing = [i for i in missing if i not in stored]
+        if not missing:
+            return lookup
+        # fixed size batches, all in flight at once
+        batches = await asyncio.gather(
+            *[
+                rpc_get_objects(rpc, missing[idx : idx + ACCOUNT_BATCH])
+                for idx in range(0, len(missing), ACCOUNT_BATCH)
+            ]
+        )
+        rows = [
+            (k, v["name"], v.get("membership_expiration_date") == LIFETIME)
+            for batch in batches
+            for k, v in batch.items()
+        ]
+        await sql.run(write_account_names, rows, write=True)
+        fetched = {i[0]: i[1] for i in rows}
+        lookup.update(fetched)
+        self.remember(fetched)
+        return lookup
+
+
+ACCOUNT_NAMES = AccountNames()
+# the membership expiration date of lifetime members
+LIFETIME = "1969-12-31T23:59:59"
+
+
 async def lookup_account_names(rpc, account_ids):
-    chunked_ids = chunks(account_ids, ceil(len(account_ids) / 100))
-    lookup = {}
-    for chunk in chunked_ids:
-        lookup = {
-            **lookup,
-            **dict(
-                zip(
-                    chunk,
-                    [i["name"] for i in (await rpc_get_objects(rpc, chunk)).values()],
-                )
-            ),
-        }
-    return lookup
+    """
+    Return {account id: account name} via the ACCOUNT_NAMES cache
+    """
+    return await ACCOUNT_NAMES.lookup(rpc, account_ids)
 
 
 async def rpc_get_objects(rpc, object_ids):
@@ -185,6 +755,57 @@ async def rpc_ticker(rpc, pair):
     return await wss_query(rpc, ["database", "get_ticker", [currency, asset, False]])
 
 
+async def rpc_set_subscribe_callback(rpc, callback):
+    """
+    notify callback of changes to every object this connection has fetched since
+    """
+    return await wss_query(
+        rpc, ["database", "set_subscribe_callback", [callback, False]]
+    )
+
+
+async def rpc_subscribe_to_market(rpc, callback, pair):
+    """
+    notify callback whenever orders in the market are placed, filled or cancelled
+    """
+    asset, currency = pair.split(":")
+    return await wss_query(
+        rpc, ["database", "subscribe_to_market", [callback, currency, asset]]
+    )
+
+
+async def rpc_unsubscribe_from_market(rpc, pair):
+    """
+    stop the notices of an earlier subscribe_to_market
+    """
+    asset, currency = pair.split(":")
+    return await wss_query(
+        rpc, ["database", "unsubscribe_from_market", [currency, asset]]
+    )
+
+
+async def rpc_tickers(rpc, pairs, concurrency=TICKER_CONCURRENCY):
+    """
+    RPC the latest ticker of many pairs at once, in the order of pairs
+    at most concurrency requests are pipelined on the connection at a time
+    a hub client's own in flight limit is lifted to concurrency for the batch
+    :return [ticker or None when it failed, ...]:
+    """
+    if isinstance(rpc, HubClient):
+        rpc = rpc.hub.client(concurrency)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def ticker(pair):
+        async with slots:
+            try:
+                return await rpc_ticker(rpc, pair)
+            except Exception as error:
+                print(it("orange", f"ticker {pair} failed with error '{error}'"))
+                return None
+
+    return await asyncio.gather(*[ticker(pair) for pair in pairs])
+
+
 async def get_max_object(rpc, space):
     """
     get the maximum object id within this instance space
@@ -211,16 +832,24 @@ async def get_max_object(rpc, space):
     return max_object
 
 
+async def rpc_get_liquidity_pools(rpc, pools):
+    """
+    Return the liquidity pool objects, with 24h statistics, of a list of pool ids
+    """
+    ret = await wss_query(
+        rpc, ["database", "get_liquidity_pools", [pools, False, True]]
+    )
+    return {pools[idx]: item for idx, item in enumerate(ret) if item is not None}
+
+
 async def get_liquidity_pool_volume(rpc, pools):
     """
     get the sum amount a volume for a given set of liquidity pools
     """
     return {
-        i["id"]: int(i["statistics"]["_24h_exchange_a2b_amount_a"])
-        + int(i["statistics"]["_24h_exchange_b2a_amount_a"])
-        for i in await wss_query(
-            rpc, ["database", "get_liquidity_pools", [pools, False, True]]
-        )
+        k: int(v["statistics"]["_24h_exchange_a2b_amount_a"])
+        + int(v["statistics"]["_24h_exchange_b2a_amount_a"])
+        for k, v in (await rpc_get_liquidity_pools(rpc, pools)).items()
     }
 
 
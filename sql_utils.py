@@ -6,10 +6,160 @@
 Bitshares Decentralized Exchange User Experience
 """
 
+# STANDARD MOUDLES
+import time
+from threading import Lock
+
 # BITSHARES DEX UX MODULES
+from asset_search import AssetSearch
+from config import METADATA_CHECK
 from database import Sql
 from utilities import is_whitelisted
 
+# candle resolutions in seconds, the interval column of the candles table
+INTERVALS = [900, 1800, 3600, 7200, 14400, 43200, 86400]
+CANDLE_COLUMNS = ["time", "open", "high", "low", "close", "volume"]
+
+
+class Metadata:
+    """
+    process wide read-through cache of the assets and pools tables
+    everything is loaded on first use; a lookup which misses is read from sql
+    and remembered, invalidate() forces a full reload on the next lookup
+    assets and pools added by another process, ie. init_database, bump the
+    versions table, which is checked every METADATA_CHECK seconds
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.loaded = False
+        # bumped whenever a symbol or pool changes so that derived indexes rebuild
+        self.version = 0
+        # the versions table row this cache was loaded at, and when it was checked
+        self.stamp = None
+        self.checked = 0
+        # asset id -> assets row
+        self.assets = {}
+        # asset symbol -> asset id
+        self.symbols = {}
+        # pool id -> pools row
+        self.pools = {}
+
+    def load(self, sql=None):
+        """
+        (re)load every asset and pool from the database
+        """
+        sql = sql or Sql()
+        # read before the tables, a change in between is reloaded at the next check
+        stamp = self.database_version(sql)
+        assets = sql.execute("SELECT * FROM assets")
+        pools = sql.execute("SELECT * FROM pools")
+        with self.lock:
+            self.assets = {i["id"]: i for i in assets}
+            self.symbols = {i["symbol"]: i["id"] for i in assets}
+            self.pools = {i["id"]: i for i in pools}
+            self.loaded = True
+            self.version += 1
+            self.stamp = stamp
+            self.checked = time.monotonic()
+
+    @staticmethod
+    def database_version(sql):
+        """
+        the metadata row of the versions table, 0 before the database is upgraded
+        """
+        rows = sql.execute("SELECT version FROM versions WHERE name='metadata'")
+        return rows[0]["version"] if rows else 0
+
+    def refresh(self, sql=None):
+        """
+        load on first use, or when another process has since added assets or pools
+        the database is asked at most once every METADATA_CHECK seconds
+        """
+        if self.loaded and time.monotonic() - self.checked < METADATA_CHECK:
+            return
+        sql = sql or Sql()
+        if not self.loaded or self.database_version(sql) != self.stamp:
+            self.load(sql)
+        else:
+            self.checked = time.monotonic()
+
+    def invalidate(self):
+        """
+        drop the cache after the assets or pools tables have changed
+        """
+        self.loaded = False
+
+    def remember(self, table, row):
+        """
+        add or replace a single assets or pools row in the cache
+        the version is only bumped when the row is new or differs,
+        rows read through again as they were leave derived indexes alone
+        """
+        with self.lock:
+            if table == "assets":
+                changed = self.assets.get(row["id"]) != row
+                self.assets[row["id"]] = row
+                self.symbols[row["symbol"]] = row["id"]
+            else:
+                changed = self.pools.get(row["id"]) != row
+                self.pools[row["id"]] = row
+            if changed:
+                self.version += 1
+
+    def update_pools(self, rows):
+        """
+        replace pools rows whose balances or volumes changed
+        no derived index uses those columns, so the version is not bumped
+        """
+        with self.lock:
+            for row in rows:
+                self.pools[row["id"]] = row
+
+    def read_through(self, sql, table, column, value):
+        """
+        read one row missing from the cache, IndexError if it does not exist
+        SQL SECURITY: table and column are hard coded by the callers below
+        """
+        sql = sql or Sql()
+        query = [
+            {"query": f"SELECT * FROM {table} WHERE {column}=?", "values": (value,)}
+        ]
+        row = sql.execute(query)[0]
+        self.remember(table, row)
+        return row
+
+    def asset(self, sql, asset_id):
+        """
+        the assets row of an asset id
+        """
+        self.refresh(sql)
+        if asset_id in self.assets:
+            return self.assets[asset_id]
+        return self.read_through(sql, "assets", "id", asset_id)
+
+    def asset_by_symbol(self, sql, symbol):
+        """
+        the assets row of an asset symbol
+        """
+        self.refresh(sql)
+        if symbol in self.symbols:
+            return self.assets[self.symbols[symbol]]
+        return self.read_through(sql, "assets", "symbol", symbol)
+
+    def pool(self, sql, pool_id):
+        """
+        the pools row of a pool id
+        """
+        self.refresh(sql)
+        if pool_id in self.pools:
+            return self.pools[pool_id]
+        return self.read_through(sql, "pools", "id", pool_id)
+
+
+METADATA = Metadata()
+ASSET_SEARCH = AssetSearch(METADATA)
+
 
 def list_assets_sql(sql, asset, use_types):
     """
@@ -17,7 +167,7 @@ def list_assets_sql(sql, asset, use_types):
     """
     if asset.startswith("1.3."):
         query = [{"query": "SELECT symbol FROM assets WHERE id=?", "values": (asset,)}]
-        data = sql.execute(query)
+        data = [{"symbol": i[0]} for i in sql.execute(query, raw=True)]
     elif asset.startswith("1.19."):
         query = [
             {
@@ -28,80 +178,172 @@ def list_assets_sql(sql, asset, use_types):
         data = sql.execute(query)[0]
         data = [{"symbol": ":".join(data["xyk"].split(":"))[:-1], **data}]
     else:
-        data = query_by_asset_type(use_types, sql, asset)
+        # ranked, deduplicated and sorted by the in memory search index
+        return ASSET_SEARCH.search(sql, asset, use_types)
     data = [{**i, "greyscale": is_whitelisted(i["symbol"])} for i in data]
     # data = data[:depth]
     data.sort(key=lambda x: x["symbol"])
     return data
 
 
-def query_by_asset_type(use_types, sql, asset):
-    """
-    each asset type will have a different query format
-    """
-    mpa_data = []
-    uia_data = []
-    lp_data = []
-    pool_data = []
-    # Make SQL queries by user selected asset type
-    if use_types["mpa"]:
-        mpa_data = query_template('bitasset_id <> ""', sql, asset)
-    if use_types["uia"]:
-        uia_data = query_template('bitasset_id = "" AND pool_id = ""', sql, asset)
-    if use_types["k_token"]:
-        lp_data = query_template('pool_id <> ""', sql, asset)
-    if use_types["pool"]:
-        pool_data = sql.execute("SELECT xyk, share_asset_name, id FROM pools")
-        # sort by those that contiain the search string
-        # and rename xyk to symbol for easier processing
-        # but keep xyk availible for checking if it came from a pool search
-        pool_data = [
-            {
-                "symbol": (
-                    i["id"].ljust(17, "*")
-                    + "".join([j.ljust(17, "*") for j in i["xyk"].split(":")[:-1:]])
-                ).replace("*", "&nbsp;"),
-                **i,
-            }
-            for i in pool_data
-            if asset in i["xyk"]
-        ]
-    result = mpa_data + uia_data + lp_data + pool_data
-    if use_types["bts"]:
-        result.append({"symbol": "BTS"})
-    return result
+def precision(sql, asset):
+    """
+    Get the precision of an asset from the metadata cache
+    """
+    return METADATA.asset(sql, asset)["precision"]
 
 
-def query_template(condition, sql, asset):
+def name_id_lookup(sql, asset):
     """
-    build a SELECT sql asset symbol query for a condition
-    SQL SECURITY: condition is hard coded in query_by_asset_type
+    Get the name of an asset from its ID from the metadata cache
     """
-    query = f"SELECT symbol, id FROM assets WHERE {condition}"
-    return [i for i in sql.execute(query) if asset in i["symbol"]]
+    return METADATA.asset(sql, asset)["symbol"]
 
 
-def precision(sql, asset):
+def id_name_lookup(sql, asset):
     """
-    Get the precision of an asset from the SQL database
+    Get the ID of an asset from its name from the metadata cache
     """
-    if not sql:
-        sql = Sql()
-    query = [{"query": "SELECT precision FROM assets WHERE id=?", "values": (asset,)}]
-    return sql.execute(query)[0]["precision"]
+    return METADATA.asset_by_symbol(sql, asset)["id"]
 
 
-def name_id_lookup(sql, asset):
+def pool_lookup(sql, pool_id, asset_a_name, asset_b_name):
     """
-    Get the name of an asset from its ID from the SQL database
+    Get the pools row of a pool from the metadata cache
+    IndexError when the pool does not trade the given assets
     """
-    query = [{"query": "SELECT symbol FROM assets WHERE id=?", "values": (asset,)}]
-    return sql.execute(query)[0]["symbol"]
+    pool = METADATA.pool(sql, pool_id)
+    if (pool["asset_a_name"], pool["asset_b_name"]) != (asset_a_name, asset_b_name):
+        raise IndexError(f"{pool_id} is not {asset_a_name}:{asset_b_name}")
+    return pool
 
 
-def id_name_lookup(sql, asset):
+def read_account_names(sql, account_ids):
+    """
+    Get {account id: account name} of the ids already in the accounts table
+    """
+    names = {}
+    # well within sqlite's limit on the number of ? parameters
+    for idx in range(0, len(account_ids), 500):
+        chunk = tuple(account_ids[idx : idx + 500])
+        query = (
+            "SELECT account_id, account_name FROM accounts"
+            f" WHERE account_id IN ({','.join('?' * len(chunk))})"
+        )
+        names.update(sql.execute(query, chunk, raw=True))
+    return names
+
+
+def write_account_names(sql, rows):
+    """
+    Store [(account id, account name, is lifetime member), ...] in the accounts table
+    """
+    return sql.executemany("INSERT OR REPLACE INTO accounts VALUES (?,?,?)", rows)
+
+
+def canonical_market(market):
+    """
+    klines are stored oldest token first, regardless of the user request
+    market is "asset_id:currency_id", ie. 1.3.5589:1.3.0 becomes 1.3.0:1.3.5589
+    """
+    return ":".join(f"1.3.{i}" for i in sorted(int(j[4:]) for j in market.split(":")))
+
+
+def read_candles(sql, pair, interval, start=0, stop=None):
     """
-    Get the ID of an asset from its name from the SQL database
+    Get the candles of one interval for a pair, oldest first
+    optionally only those within start and stop, in milliseconds
     """
-    query = [{"query": "SELECT id FROM assets WHERE symbol=?", "values": (asset,)}]
-    return sql.execute(query)[0]["id"]
+    query = (
+        "SELECT time, open, high, low, close, volume FROM candles"
+        " WHERE pair=? AND interval=? AND time>=? AND time<=? ORDER BY time"
+    )
+    values = (pair, interval, start, 2**63 - 1 if stop is None else stop)
+    return [dict(zip(CANDLE_COLUMNS, i)) for i in sql.execute(query, values, raw=True)]
+
+
+def read_trades(sql, pair):
+    """
+    Get the discrete trades for a pair, oldest first, in columnar format
+    [[unix], [price], [volume], [account], [blocknum], [op_id], [hover]]
+    """
+    query = (
+        "SELECT time, price, volume, account, blocknum, op_id, hover FROM trades"
+        " WHERE pair=? ORDER BY time"
+    )
+    return [list(i) for i in zip(*sql.execute(query, (pair,), raw=True))]
+
+
+def read_klines(sql, pair):
+    """
+    Get every candle interval and the discrete trades for a pair
+    keyed as ["discrete", "c900", "c1800", ... "c86400"]
+    """
+    return {
+        "discrete": read_trades(sql, pair),
+        **{f"c{i}": read_candles(sql, pair, i) for i in INTERVALS},
+    }
+
+
+def read_market(sql, pair):
+    """
+    The klines row of a pair, or None, with every candle interval and trade
+    read from one snapshot, so that the sync cursor matches the candles
+    """
+    query = (
+        "SELECT end_unix, last_unix, last_block, revision FROM klines WHERE pair=?"
+    )
+    with sql.snapshot():
+        rows = sql.execute(query, (pair,))
+        return (rows[0] if rows else None), read_klines(sql, pair)
+
+
+def upsert_candles(pair, interval, candles):
+    """
+    Build the queries to insert or replace candle buckets for a pair
+    """
+    return [
+        {
+            "query": "INSERT OR REPLACE INTO candles VALUES (?,?,?,?,?,?,?,?)",
+            "values": (pair, interval, *[i[k] for k in CANDLE_COLUMNS]),
+        }
+        for i in candles
+    ]
+
+
+def upsert_trades(pair, trades):
+    """
+    Build the queries to insert or replace discrete trades for a pair
+    trades = [[unix, price, volume, account, blocknum, op_id, hover], ...]
+    """
+    return [
+        {
+            "query": "INSERT OR REPLACE INTO trades VALUES (?,?,?,?,?,?,?,?)",
+            "values": (pair, *i[:6], i[6] if len(i) > 6 else ""),
+        }
+        for i in trades
+    ]
+
+
+def migrate_klines(sql):
+    """
+    One shot move of the legacy JSON columns in klines to the candles and trades tables
+    """
+    for row in sql.execute("SELECT * FROM klines WHERE c86400 IS NOT NULL"):
+        queries = []
+        for interval in INTERVALS:
+            candles = [i for i in row[f"c{interval}"] or [] if i]
+            queries.extend(upsert_candles(row["pair"], interval, candles))
+        queries.extend(upsert_trades(row["pair"], list(zip(*row["discrete"] or []))))
+        queries.append(
+            {
+                "query": (
+                    "UPDATE klines SET c86400=NULL, c43200=NULL, c14400=NULL,"
+                    " c7200=NULL, c3600=NULL, c1800=NULL, c900=NULL, discrete=NULL"
+                    " WHERE pair=?"
+                ),
+                "values": (row["pair"],),
+            }
+        )
+        sql.execute(queries)
+        print("Migrated klines to candles and trades for", row["pair"])
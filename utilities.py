@@ -7,13 +7,13 @@ Bitshares Decentralized Exchange User Experience
 """
 # STANDARD MODULES
 import contextlib
+import itertools
 import math
 import os
 import sys
 import time
 from datetime import datetime
 from json import loads as json_loads
-from threading import Thread
 from traceback import format_exc
 
 # GLOBAL CONSTANTS
@@ -21,95 +21,45 @@ ATTEMPTS = 3
 PATH = f"{str(os.path.dirname(os.path.abspath(__file__)))}/"
 
 
-class NonceSafe:
-    """
-    ╔═══════════════════════════════╗
-    ║ ╔╗╔╔═╗╔╗╔╔═╗╔═╗  ╔═╗╔═╗╔═╗╔═╗ ║
-    ║ ║║║║ ║║║║║  ║╣   ╚═╗╠═╣╠╣ ║╣  ║
-    ║ ╝╚╝╚═╝╝╚╝╚═╝╚═╝  ╚═╝╩ ╩╚  ╚═╝ ║
-    ╚═══════════════════════════════╝
-
-    context manager for process-safe nonce generation and inter process communication
-        nonce generation
-        process safe read
-        process safe write
-        process safe atomic read/write
-    wtfpl litepresence.com 2022
-    """
+# request ids count up from the nanosecond clock at import, one per call
+NONCES = itertools.count(time.time_ns())
+# last id handed out to any process, for get_nonce(shared=True)
+NONCE_FILE = f"{PATH}.nonce"
 
-    @staticmethod
-    def __enter__(*_) -> None:
-        """
-        file lock: try until success to change name of nonce.vacant to nonce.occupied
-        """
-        if not os.path.exists(f"{PATH}nonce_safe/nonce.vacant") and not os.path.exists(
-            f"{PATH}nonce_safe/nonce.occupied"
-        ):
-            NonceSafe.restart()
-        while True:
-            # fails when nonce.occupied
-            try:
-                os.rename("nonce_safe/nonce.vacant", "nonce_safe/nonce.occupied")
-                break
-            except Exception:
-                time.sleep(0.01)
-
-    @staticmethod
-    def __exit__(*_) -> None:
-        """
-        file unlock : change name of nonce.occupied back to nonce.vacant
-        """
-        os.rename("nonce_safe/nonce.occupied", "nonce_safe/nonce.vacant")
-
-    @staticmethod
-    def restart() -> None:
-        """
-        new locker: on startup, delete directory and start fresh
-        """
-        os.system(
-            f"rm -r {PATH}nonce_safe; "
-            + f"mkdir {PATH}nonce_safe; "
-            + f"touch {PATH}nonce_safe/nonce.vacant"
-        )
-        thread = Thread(target=NonceSafe.free)
-        thread.start()
-
-    @staticmethod
-    def free() -> None:
-        """
-        the nonce locker should never be occupied for more than a few milliseconds
-        plausible the locker could get stuck, e.g. a process terminates while occupied
-        """
-        while True:
-            # check every three seconds if the nonce is vacant
-            if os.path.exists(f"{PATH}nonce_safe/nonce.vacant"):
-                time.sleep(3)
-            else:
-                # check repeatedly for 3 seconds for vacancy
-                start = time.time()
-                while True:
-                    elapsed = time.time() - start
-                    if os.path.exists(f"{PATH}nonce_safe/nonce.vacant"):
-                        break
-                    # liberate the nonce locker
-                    if elapsed > 3:
-                        os.rename(
-                            "nonce_safe/nonce.occupied", "nonce_safe/nonce.vacant"
-                        )
-
-
-def get_nonce(precision: int = 1e9) -> int:
+
+def get_nonce(shared: bool = False) -> int:
     """
-    :param precision: int(10^n)
+    a unique, increasing request id
+    next() on an itertools.count is atomic, so this needs no lock within a process
+    :param shared: also unique among processes sharing NONCE_FILE, via an fcntl lock
     :return nonce:
     """
-    with NonceSafe():
-        now = int(time.time() * precision)
-        while True:
-            nonce = int(time.time() * precision)
-            if nonce > now:
-                return nonce
-            time.sleep(1 / (10 * precision))
+    if not shared:
+        return next(NONCES)
+    # POSIX only; the lock is released when the file is closed
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    handle = os.open(NONCE_FILE, os.O_RDWR | os.O_CREAT)
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        last = int.from_bytes(os.pread(handle, 8, 0) or b"\0", "little")
+        nonce = max(last + 1, next(NONCES))
+        os.pwrite(handle, nonce.to_bytes(8, "little"), 0)
+    finally:
+        os.close(handle)
+    return nonce
+
+
+def benchmark_nonce(calls=100000):
+    """
+    per call overhead of get_nonce in and across processes
+    """
+    for shared in [False, True]:
+        start = time.perf_counter()
+        nonces = [get_nonce(shared) for _ in range(calls)]
+        elapsed = time.perf_counter() - start
+        assert len(set(nonces)) == calls and nonces == sorted(nonces)
+        print(f"shared={shared}: {elapsed / calls * 1e6:.3f} microseconds per call")
 
 
 def chunks(l, n):
@@ -330,3 +280,7 @@ def from_iso_date(date):
     returns unix epoch given YYYY-MM-DD
     """
     return int(time.mktime(time.strptime(str(date), "%Y-%m-%d %H:%M:%S")))
+
+
+if __name__ == "__main__":
+    benchmark_nonce()